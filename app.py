@@ -1,23 +1,39 @@
 from flask import Flask
-from controllers.data_processor_rest_controller import measurements_bp
-from tests.connection_test import test_bp
-from controllers.images_rest_controller import images_bp
-from controllers.simulation_rest_controller import simulations_bp
-from controllers.simulation_health_rest_controller import health_simulation_bp
-from controllers.reports_rest_controller import reports_bp
-from repositories.pollution_measurement_repository import PollutionMeasurementsRepository
+from modules.model_registry import timed_import, report_import_times
 import os
 
-app = Flask(__name__)
+# (modulo, blueprint) nell'ordine di registrazione; gli import sono cronometrati all'avvio
+BLUEPRINTS = (
+    ("controllers.data_processor_rest_controller", "measurements_bp"),
+    ("tests.connection_test", "test_bp"),
+    ("controllers.simulation_rest_controller", "simulations_bp"),
+    ("controllers.images_rest_controller", "images_bp"),
+    ("controllers.simulation_health_rest_controller", "health_simulation_bp"),
+    ("controllers.reports_rest_controller", "reports_bp"),
+)
+
+
+def create_app():
+    '''
+    Factory dell'applicazione: usata da gunicorn (gunicorn.conf.py) in produzione,
+    una volta per worker, e da python app.py in sviluppo.
+    TensorFlow, cartopy, sklearn e i modelli vengono caricati al primo endpoint che li usa (ModelRegistry).
+    '''
+    app = Flask(__name__)
+
+    blueprints = [getattr(timed_import(module_name), name) for module_name, name in BLUEPRINTS]
+    repositories = timed_import("repositories.pollution_measurement_repository")
+    indexes = timed_import("repositories.index_manager")
+    report_import_times()
+
+    repositories.PollutionMeasurementsRepository()
+    indexes.IndexManager().bootstrap()
+
+    for blueprint in blueprints:
+        app.register_blueprint(blueprint)
+    return app
 
-PollutionMeasurementsRepository()
 
 if __name__ == "__main__":
-    app.register_blueprint(measurements_bp)
-    app.register_blueprint(test_bp)
-    app.register_blueprint(simulations_bp)
-    app.register_blueprint(images_bp)
-    app.register_blueprint(health_simulation_bp)
-    app.register_blueprint(reports_bp)
+    app = create_app()
     app.run(host="0.0.0.0",port=8080, debug=True)
-
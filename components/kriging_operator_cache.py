@@ -0,0 +1,160 @@
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from scipy.linalg import cholesky, solve_triangular
+from modules.singleton import singleton
+from config.constants import PREDICTION_OPERATOR_CACHE_SIZE
+
+
+def bounds_key(bounds):
+    return (bounds["west"], bounds["east"], bounds["south"], bounds["north"])
+
+
+def coords_hash(coords):
+    """Hash stabile delle coordinate delle stazioni (ordine incluso)"""
+    coords = np.ascontiguousarray(coords, dtype=np.float64)
+    digest = hashlib.sha1(coords.tobytes())
+    digest.update(str(coords.shape).encode())
+    return digest.hexdigest()
+
+
+def key_digest(key):
+    """Digest stabile di una chiave della cache (valori float esatti), per riconoscerla su disco"""
+    return hashlib.sha1(repr(key).encode()).hexdigest()
+
+
+def kernel_key(kernel):
+    """Chiave del kernel: struttura + valori esatti degli iperparametri"""
+    names = tuple(h.name for h in kernel.hyperparameters)
+    return (type(kernel).__name__, names, tuple(np.exp(kernel.theta).tolist()))
+
+
+class PredictionOperator:
+    """
+    Operatore di predizione griglia <- stazioni.
+    weights = K(griglia, stazioni) K(stazioni, stazioni)^-1, variance = varianza predittiva
+    (indipendente dai valori misurati, in unita' normalizzate).
+    """
+
+    def __init__(self, weights, variance):
+        self.weights = weights
+        self.variance = variance
+
+    @property
+    def nbytes(self):
+        return self.weights.nbytes + self.variance.nbytes
+
+    def predict(self, values, normalize_y=True):
+        """Predizione per nuovi valori alle stesse stazioni: un prodotto matrice-vettore"""
+        values = np.asarray(values, dtype=float)
+        if normalize_y:
+            y_mean = values.mean(axis=0)
+            y_std = values.std(axis=0)
+            y_std = np.where(y_std < 10 * np.finfo(y_std.dtype).eps, 1.0, y_std)
+        else:
+            y_mean, y_std = 0.0, 1.0
+
+        mean = (self.weights @ ((values - y_mean) / y_std)) * y_std + y_mean
+        std = np.sqrt(np.multiply.outer(self.variance, np.square(y_std)))
+        return mean, std
+
+
+def build_prediction_operator(kernel, X_train, grid_coords, L=None, alpha=1e-6):
+    if L is None:
+        K = kernel(X_train)
+        K[np.diag_indices_from(K)] += alpha
+        L = cholesky(K, lower=True, check_finite=False)
+
+    K_trans = kernel(grid_coords, X_train)
+    V = solve_triangular(L, K_trans.T, lower=True, check_finite=False)
+    weights = solve_triangular(L.T, V, lower=False, check_finite=False).T
+
+    variance = kernel.diag(grid_coords).copy()
+    variance -= np.einsum("ij,ij->j", V, V)
+    variance[variance < 0] = 0.0
+
+    return PredictionOperator(np.ascontiguousarray(weights), variance)
+
+
+@singleton
+class PredictionOperatorCache:
+    """
+    Cache LRU degli operatori di predizione, con chiave
+    (bounds della regione, risoluzione, hash coordinate stazioni, parametri kernel).
+    """
+
+    def __init__(self, maxsize=PREDICTION_OPERATOR_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(bounds, resolution, X_train, kernel):
+        return (bounds_key(bounds), resolution, coords_hash(X_train), kernel_key(kernel))
+
+    def get(self, key):
+        with self._lock:
+            operator = self._entries.get(key)
+            if operator is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return operator
+
+    def put(self, key, operator):
+        with self._lock:
+            self._entries[key] = operator
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get_or_build(self, key, builder):
+        operator = self.get(key)
+        if operator is None:
+            operator = builder()
+            self.put(key, operator)
+        return operator
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+                "maxsize": self.maxsize,
+                "nbytes": sum(op.nbytes for op in self._entries.values()),
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+def predict_on_grid(gp, grid_coords, bounds, resolution):
+    """
+    Equivalente di gp.predict(grid_coords, return_std=True) per un GP gia' addestrato,
+    ma riusa l'operatore di predizione in cache se stazioni e kernel non sono cambiati.
+    """
+    cache = PredictionOperatorCache()
+    key = cache.make_key(bounds, resolution, gp.X_train_, gp.kernel_)
+    operator = cache.get_or_build(
+        key, lambda: build_prediction_operator(gp.kernel_, gp.X_train_, grid_coords, L=gp.L_)
+    )
+
+    mean = (operator.weights @ gp.y_train_) * gp._y_train_std + gp._y_train_mean
+    std = np.sqrt(np.multiply.outer(operator.variance, np.square(gp._y_train_std)))
+
+    # stesse forme di gp.predict: (n,) per output singolo
+    if mean.ndim > 1 and mean.shape[1] == 1:
+        mean = np.squeeze(mean, axis=1)
+    if std.ndim > 1 and std.shape[1] == 1:
+        std = np.squeeze(std, axis=1)
+    return mean, std
@@ -0,0 +1,82 @@
+import os
+import json
+import time
+import numpy as np
+from components.kriging_operator_cache import PredictionOperator, key_digest
+from config.constants import OUTPUT_KRIGING_STATE, KRIGING_STATE_MAX_AGE
+
+
+def _state_path(region, pollutants):
+    return os.path.join(OUTPUT_KRIGING_STATE, f"{region}_{'-'.join(pollutants)}.json")
+
+
+def _operator_path(region, pollutants):
+    return os.path.join(OUTPUT_KRIGING_STATE, f"{region}_{'-'.join(pollutants)}.operator.npz")
+
+
+def load_kriging_state(region, pollutants, kernel_config):
+    """
+    Iperparametri (theta, log) dell'ultimo fit per (regione, gruppo di inquinanti).
+    None se assenti, illeggibili o ottenuti con una configurazione del kernel diversa.
+    """
+    try:
+        with open(_state_path(region, pollutants), "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (FileNotFoundError, ValueError, OSError):
+        return None
+
+    if state.get("kernel_config") != list(kernel_config):
+        return None
+    return state
+
+
+def is_state_fresh(state, coords_digest, max_age=KRIGING_STATE_MAX_AGE):
+    """
+    Uno stato recente e ottenuto con le stesse stazioni viene usato cosi' com'e'; uno vecchio,
+    o di un insieme di stazioni diverso, solo come punto di partenza dell'ottimizzazione.
+    """
+    if state.get("coords_hash") != coords_digest:
+        return False
+    return time.time() - state["fitted_at"] < max_age
+
+
+def save_kriging_state(region, pollutants, kernel_config, fitted_kernel, coords_digest):
+    """Salva gli iperparametri ottimizzati; scrittura atomica, il file e' condiviso tra i processi del pool"""
+    os.makedirs(OUTPUT_KRIGING_STATE, exist_ok=True)
+    path = _state_path(region, pollutants)
+    state = {
+        "kernel_config": list(kernel_config),
+        "theta": fitted_kernel.theta.tolist(),
+        "coords_hash": coords_digest,
+        "fitted_at": time.time(),
+    }
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def load_prediction_operator(region, pollutants, key):
+    """
+    Operatore di predizione salvato accanto allo stato, condiviso tra i processi del pool e
+    tra i batch. None se assente, illeggibile o costruito per un'altra chiave della cache.
+    """
+    try:
+        with np.load(_operator_path(region, pollutants)) as data:
+            if str(data["key"]) != key_digest(key):
+                return None
+            return PredictionOperator(data["weights"], data["variance"])
+    except (FileNotFoundError, ValueError, KeyError, OSError):
+        return None
+
+
+def save_prediction_operator(region, pollutants, key, operator):
+    """Un solo operatore per (regione, gruppo di inquinanti), sovrascritto in modo atomico"""
+    os.makedirs(OUTPUT_KRIGING_STATE, exist_ok=True)
+    path = _operator_path(region, pollutants)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, key=key_digest(key), weights=operator.weights, variance=operator.variance)
+    os.replace(tmp_path, path)
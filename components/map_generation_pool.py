@@ -0,0 +1,287 @@
+import os
+import time
+import weakref
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from components.model_inference_service import (
+    create_grid,
+    run_multi_output_kriging,
+    generate_kriging_map_image
+)
+from components.model_inference_health_service import run_health_impact_map_kriging
+from models.domain import DataMap
+from utils.tile_utils import write_tile_pyramid
+from utils.grid_store import save_grids
+from config.constants import (
+    PUGLIA_BOUNDS,
+    MAP_POOL_WORKERS,
+    MAP_JOB_TIMEOUT,
+    MAP_POOL_MAX_TASKS_PER_CHILD,
+    MAP_TILES_ENABLED
+)
+
+# Pool persistenti del worker: mappe orarie e simulazioni non condividono i processi,
+# un timeout di una simulazione non termina i job delle mappe (e viceversa)
+MAP_POOL = "maps"
+SIMULATION_POOL = "simulations"
+
+# Un job perso perche' il pool e' stato interrotto viene ripreso al massimo queste volte
+MAX_JOB_LOSSES = 2
+
+# Stato di ogni pool (job in corso, job sottomessi, terminato); sparisce con il pool
+_executors = {}
+_pool_state = weakref.WeakKeyDictionary()
+_executors_lock = threading.Lock()
+
+
+def _new_executor(max_workers):
+    # spawn: il worker Celery gira con --pool threads, fork non e' sicuro
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn")
+    )
+
+
+def _shutdown_executor(executor):
+    """Chiude il pool senza attendere e termina anche i processi ancora occupati (job in timeout)"""
+    processes = list((executor._processes or {}).values())
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+
+
+def get_executor(pool, max_workers):
+    """
+    Pool di processi persistente del worker, creato alla prima richiesta e riusato dai batch
+    successivi: i processi restano caldi (import, modelli, cache degli operatori di kriging).
+    """
+    with _executors_lock:
+        executor = _executors.get(pool)
+        if executor is None:
+            executor = _executors[pool] = _new_executor(max_workers)
+            _pool_state[executor] = {"inflight": [], "submitted": 0, "terminated": False}
+        return executor
+
+
+def reset_executor(pool, executor):
+    """
+    Termina il pool (anche i job rimasti appesi), una sola volta anche se piu' thread lo
+    chiedono. Il prossimo get_executor ne crea uno nuovo.
+    """
+    with _executors_lock:
+        state = _pool_state.get(executor)
+        if state is None or state["terminated"]:
+            return
+        state["terminated"] = True
+        if _executors.get(pool) is executor:
+            del _executors[pool]
+    _shutdown_executor(executor)
+
+
+def _retire_executor(pool, executor):
+    """
+    Riciclo dei processi dopo MAP_POOL_MAX_TASKS_PER_CHILD job ciascuno (in media): il pool
+    non riceve piu' job, conclude quelli gia' sottomessi e i suoi processi escono.
+    Chiamata con _executors_lock acquisito.
+    max_tasks_per_child del pool non si usa: con spawn richiede Python 3.11 e in 3.11 un processo
+    sostituito puo' lasciare appesi i job gia' in coda fino al timeout.
+    """
+    state = _pool_state[executor]
+    limit = MAP_POOL_MAX_TASKS_PER_CHILD * executor._max_workers
+    if MAP_POOL_MAX_TASKS_PER_CHILD <= 0 or state["submitted"] < limit:
+        return
+    if _executors.get(pool) is executor:
+        del _executors[pool]
+        executor.shutdown(wait=False)
+        print(f"[run_jobs] Pool '{pool}' riciclato dopo {state['submitted']} job")
+
+
+def _submit_jobs(pool, jobs, max_workers, attempts=2):
+    """Sottomette i job sul pool persistente; se il pool non accetta job viene ricreato"""
+    for _ in range(attempts):
+        executor = get_executor(pool, max_workers)
+        futures = {}
+        try:
+            with _executors_lock:
+                state = _pool_state[executor]
+                for label, fn, args in jobs:
+                    future = executor.submit(fn, *args)
+                    futures[future] = label
+                    state["inflight"].append(future)
+                state["submitted"] += len(futures)
+                _retire_executor(pool, executor)
+            return executor, futures
+        except (BrokenProcessPool, RuntimeError) as e:
+            print(f"[run_jobs] Pool non disponibile: {e}")
+            for future in futures:
+                future.cancel()
+            reset_executor(pool, executor)
+    return None, {}
+
+
+def _executing(executor):
+    """
+    Job del pool in esecuzione, None se il pool e' stato terminato da reset_executor.
+    Il pool segna "running" anche i job gia' in coda ai processi: sono in esecuzione
+    solo i primi max_workers, in ordine di sottomissione (di tutti i batch).
+    """
+    with _executors_lock:
+        state = _pool_state[executor]
+        if state["terminated"]:
+            return None
+        inflight = state["inflight"] = [future for future in state["inflight"] if not future.done()]
+        return set([future for future in inflight if future.running()][:executor._max_workers])
+
+
+def _collect(executor, futures, timeout, results):
+    """
+    Attende i job del batch e ne raccoglie i risultati in results. Si ferma al primo timeout:
+    il processo occupato non si libera, il pool va terminato.
+    Ritorna (label conclusi, label persi per pool interrotto, timeout).
+    """
+    finished = set()
+    lost = set()
+    started = {}
+    pending = set(futures)
+
+    while pending:
+        done, pending = wait(pending, timeout=1.0, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            label = futures[future]
+            try:
+                results[label] = future.result()
+                finished.add(label)
+            except BrokenProcessPool as e:
+                print(f"[run_jobs] Job '{label}' perso, pool interrotto: {e}")
+                lost.add(label)
+            except Exception as e:
+                print(f"[run_jobs] Job '{label}' fallito: {e}")
+                finished.add(label)
+
+        executing = _executing(executor)
+        if executing is None:
+            # Pool terminato da un altro thread: i job rimasti non verranno mai conclusi
+            for future in pending:
+                future.cancel()
+                print(f"[run_jobs] Job '{futures[future]}' perso, pool terminato")
+                lost.add(futures[future])
+            return finished, lost, False
+
+        now = time.monotonic()
+        for future in pending & executing:
+            started.setdefault(future, now)
+
+        expired = [future for future in pending if future in started and now - started[future] > timeout]
+        for future in expired:
+            print(f"[run_jobs] Job '{futures[future]}' in timeout dopo {timeout}s")
+            finished.add(futures[future])
+        if expired:
+            return finished, lost, True
+
+    return finished, lost, False
+
+
+def run_jobs(jobs, timeout=MAP_JOB_TIMEOUT, max_workers=MAP_POOL_WORKERS, pool=MAP_POOL):
+    """
+    Esegue i job sul pool di processi persistente e raccoglie i risultati.
+    jobs: lista di (label, funzione, args). Ritorna {label: risultato} con i soli job riusciti;
+    errori e timeout (misurati dall'avvio del singolo job) vengono loggati senza fermare gli altri.
+    Il pool viene ricreato solo dopo un timeout o se si interrompe: i job non ancora conclusi,
+    anche quelli di altri thread sullo stesso pool, vengono ripresi sul pool nuovo.
+    """
+    results = {}
+    losses = {}
+    remaining = list(jobs)
+
+    while remaining:
+        executor, futures = _submit_jobs(pool, remaining, max_workers)
+        if executor is None:
+            break
+
+        try:
+            finished, lost, timed_out = _collect(executor, futures, timeout, results)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+        if timed_out or lost:
+            # Processo bloccato su un job in timeout o pool interrotto: si riparte da un pool nuovo
+            reset_executor(pool, executor)
+
+        for label in lost:
+            losses[label] = losses.get(label, 0) + 1
+            if losses[label] >= MAX_JOB_LOSSES:
+                print(f"[run_jobs] Job '{label}' abbandonato dopo {losses[label]} interruzioni del pool")
+                finished.add(label)
+
+        remaining = [job for job in remaining if job[0] not in finished]
+        if remaining:
+            print(f"[run_jobs] {len(remaining)} job ripresi su un nuovo pool")
+
+    return results
+
+
+def kriging_job(coords, values_matrix, pollutants, bounds, kriging_params, region=None):
+    results = run_multi_output_kriging(
+        coords=coords,
+        values_matrix=values_matrix,
+        pollutants=pollutants,
+        bounds=bounds,
+        state_key=region,
+        **kriging_params
+    )
+    return {pollutant: (pred_grid, std_grid) for pollutant, (_, _, pred_grid, std_grid, _) in results.items()}
+
+
+def render_job(pollutant, pred_grid, std_grid, coords, values, bounds, resolution, region, date):
+    bounds = bounds or PUGLIA_BOUNDS
+    lon_grid, lat_grid, _ = create_grid(bounds, resolution=resolution)
+
+    image_path = generate_kriging_map_image(
+        lon_grid, lat_grid, pred_grid, coords, values, pollutant, bounds, region, extra_info=False
+    )
+
+    print(f"[render_job] Immagine salvata in: {image_path}")
+
+    grid_paths = save_grids(image_path, pred_grid, std_grid, bounds, resolution)
+
+    tiles_path = None
+    if MAP_TILES_ENABLED:
+        tiles_path = os.path.join(os.path.dirname(image_path), "tiles", pollutant.lower())
+        count = write_tile_pyramid(pred_grid, bounds, tiles_path, "viridis")
+        print(f"[render_job] {count} tile scritte in: {tiles_path}")
+
+    return DataMap(
+        date=date,
+        pollutant=pollutant,
+        url=image_path,
+        region=region,
+        tiles_path=tiles_path,
+        pred_grid_path=grid_paths["pred"],
+        std_grid_path=grid_paths["std"],
+        bounds=dict(bounds),
+        resolution=resolution
+    )
+
+
+def health_map_job(measurements, date):
+    health_image_path = run_health_impact_map_kriging(
+        measurements,
+        resolution=50,
+        target_date=None,
+        extra_info=False
+    )
+
+    print(f"[health_map_job] Immagine salvata in: {health_image_path}")
+
+    return DataMap(
+        date=date,
+        pollutant="health_index",
+        url=health_image_path,
+        region="Puglia"
+    )
@@ -1,21 +1,72 @@
 from fileinput import filename
 import os
 import numpy as np
-import matplotlib.pyplot as plt
-from sklearn.gaussian_process import GaussianProcessRegressor
-from sklearn.gaussian_process.kernels import RBF, WhiteKernel
-import cartopy.crs as ccrs
-import cartopy.feature as cfeature
 from models.domain import AirQualityMeasurement
 from config.constants import PUGLIA_BOUNDS, OUTPUT_DATAMAPS_HEALTH
 from typing import List
 from datetime import datetime
 import pandas as pd
 from utils.health_utils import generate_single_day_forecast
-import joblib
-
-with open('models/gb_model.pkl', 'rb') as f:
-    gb_model = joblib.load(f)
+from components.model_inference_service import create_grid
+from components.kriging_operator_cache import predict_on_grid
+from utils.basemap_utils import render_overlay_png, add_basemap_layer
+from modules.model_registry import ModelRegistry
+
+
+AQI_BREAKPOINTS = {
+    "PM2.5": [
+        (0.0, 12.0, 0, 50),
+        (12.1, 35.4, 51, 100),
+        (35.5, 55.4, 101, 150),
+        (55.5, 150.4, 151, 200),
+        (150.5, 250.4, 201, 300),
+        (250.5, 500.0, 301, 500)
+    ],
+    "PM10": [
+        (0, 54, 0, 50),
+        (55, 154, 51, 100),
+        (155, 254, 101, 150),
+        (255, 354, 151, 200),
+        (355, 424, 201, 300),
+        (425, 604, 301, 500)
+    ],
+    "O3": [
+        (0.000, 0.054, 0, 50),
+        (0.055, 0.070, 51, 100),
+        (0.071, 0.085, 101, 150),
+        (0.086, 0.105, 151, 200),
+        (0.106, 0.200, 201, 300)
+    ],
+    "SO2": [
+        (0, 35, 0, 50),
+        (36, 75, 51, 100),
+        (76, 185, 101, 150),
+        (186, 304, 151, 200),
+        (305, 604, 201, 300),
+        (605, 1004, 301, 500)
+    ],
+    "NO2": [
+        (0, 53, 0, 50),
+        (54, 100, 51, 100),
+        (101, 360, 101, 150),
+        (361, 649, 151, 200),
+        (650, 1249, 201, 300),
+        (1250, 2049, 301, 500)
+    ]
+}
+
+# Stesse tabelle come array (Clow, Chigh, Ilow, Ihigh) per il calcolo vettoriale
+AQI_BREAKPOINT_TABLES = {
+    pollutant: np.array(breakpoints, dtype=float)
+    for pollutant, breakpoints in AQI_BREAKPOINTS.items()
+}
+
+# Divisore e unità di destinazione delle conversioni AQI
+AQI_UNIT_CONVERSIONS = {
+    "O3": (2140, "ppm"),
+    "SO2": (2.62, "ppb"),
+    "NO2": (1.88, "ppb")
+}
 
 
 # conversioni alle unità AQI
@@ -28,6 +79,15 @@ def convert_to_aqi_unit(pollutant, value, unit):
         return value / 1.88 if unit != "ppb" else value
     else:
         return value
+
+
+def convert_to_aqi_unit_vector(pollutant, values, units):
+    """Come convert_to_aqi_unit su array di valori; units scalare o array per stazione"""
+    values = np.asarray(values, dtype=float)
+    if pollutant not in AQI_UNIT_CONVERSIONS:
+        return values
+    divisor, target_unit = AQI_UNIT_CONVERSIONS[pollutant]
+    return np.where(np.asarray(units) != target_unit, values / divisor, values)
     
 
 def calculate_aqi(concentration, breakpoints):
@@ -44,49 +104,6 @@ def calculate_aqi_overall(concentrations):
     """
     Calcola l'AQI complessivo dato un dizionario di concentrazioni.
     """
-    AQI_BREAKPOINTS = {
-        "PM2.5": [
-            (0.0, 12.0, 0, 50),
-            (12.1, 35.4, 51, 100),
-            (35.5, 55.4, 101, 150),
-            (55.5, 150.4, 151, 200),
-            (150.5, 250.4, 201, 300),
-            (250.5, 500.0, 301, 500)
-        ],
-        "PM10": [
-            (0, 54, 0, 50),
-            (55, 154, 51, 100),
-            (155, 254, 101, 150),
-            (255, 354, 151, 200),
-            (355, 424, 201, 300),
-            (425, 604, 301, 500)
-        ],
-        "O3": [
-            (0.000, 0.054, 0, 50),
-            (0.055, 0.070, 51, 100),
-            (0.071, 0.085, 101, 150),
-            (0.086, 0.105, 151, 200),
-            (0.106, 0.200, 201, 300)
-        ],
-        "SO2": [
-            (0, 35, 0, 50),
-            (36, 75, 51, 100),
-            (76, 185, 101, 150),
-            (186, 304, 151, 200),
-            (305, 604, 201, 300),
-            (605, 1004, 301, 500)
-        ],
-        "NO2": [
-            (0, 53, 0, 50),
-            (54, 100, 51, 100),
-            (101, 360, 101, 150),
-            (361, 649, 151, 200),
-            (650, 1249, 201, 300),
-            (1250, 2049, 301, 500)
-        ]
-    }
-
-
     max_aqi = 0
 
     for pollutant, conc in concentrations.items():
@@ -98,97 +115,127 @@ def calculate_aqi_overall(concentrations):
     return round(max_aqi)
 
 
+def calculate_aqi_vector(pollutant, concentrations):
+    """
+    AQI per un array di concentrazioni: ricerca della fascia con searchsorted.
+    NaN dove la concentrazione non cade in nessuna fascia (come None in calculate_aqi).
+    """
+    table = AQI_BREAKPOINT_TABLES[pollutant]
+    concentrations = np.asarray(concentrations, dtype=float)
+
+    idx = np.searchsorted(table[:, 0], concentrations, side="right") - 1
+    Clow, Chigh, Ilow, Ihigh = table[np.clip(idx, 0, len(table) - 1)].T
+
+    valid = (idx >= 0) & (concentrations <= Chigh)
+    aqi = ((Ihigh - Ilow) / (Chigh - Clow)) * (concentrations - Clow) + Ilow
+    return np.where(valid, aqi, np.nan)
 
-def create_grid(bounds, resolution=50):
-    lon_range = np.linspace(bounds["west"], bounds["east"], resolution)
-    lat_range = np.linspace(bounds["south"], bounds["north"], resolution)
-    lon_grid, lat_grid = np.meshgrid(lon_range, lat_range)
 
-    grid_coords = np.column_stack([lon_grid.ravel(), lat_grid.ravel()])
+def calculate_aqi_overall_vector(concentrations):
+    """
+    AQI complessivo per stazione, dato un dizionario inquinante -> array di concentrazioni.
+    """
+    max_aqi = None
 
-    return lon_grid, lat_grid, grid_coords
+    for pollutant, conc in concentrations.items():
+        if pollutant in AQI_BREAKPOINT_TABLES:
+            aqi = np.nan_to_num(calculate_aqi_vector(pollutant, conc), nan=0.0)
+            max_aqi = aqi if max_aqi is None else np.maximum(max_aqi, aqi)
 
+    if max_aqi is None:
+        return np.zeros(0, dtype=int)
+    return np.round(np.maximum(max_aqi, 0)).astype(int)
+
+
+def build_health_features(pm25, pm10, no2, o3, so2, temperature_kelvin, humidity, wind_speed, units="µg/m³"):
+    """
+    Calcola in un colpo solo il vettore AQI e la matrice delle feature del gb_model
+    a partire dagli array per stazione. units: unità comune o dizionario inquinante -> unità.
+    """
+    units = units if isinstance(units, dict) else {p: units for p in ["PM2.5", "PM10", "O3", "SO2", "NO2"]}
+
+    pm25_ug = convert_to_aqi_unit_vector("PM2.5", pm25, units["PM2.5"])
+    pm10_ug = convert_to_aqi_unit_vector("PM10", pm10, units["PM10"])
+    o3_ppm = convert_to_aqi_unit_vector("O3", o3, units["O3"])
+    so2_ppb = convert_to_aqi_unit_vector("SO2", so2, units["SO2"])
+    no2_ppb = convert_to_aqi_unit_vector("NO2", no2, units["NO2"])
+
+    aqi = calculate_aqi_overall_vector({
+        "PM2.5": pm25_ug,  # µg/m³
+        "PM10": pm10_ug,   # µg/m³
+        "O3": o3_ppm,   # ppm
+        "SO2": so2_ppb, # ppb
+        "NO2": no2_ppb  # ppb
+    })
+
+    temperature_celsius = np.round(np.asarray(temperature_kelvin, dtype=float) - 273.15, 1)
+
+    features = pd.DataFrame({
+        "AQI": aqi,
+        "PM10": pm10_ug,
+        "PM2_5": pm25_ug,
+        "NO2": no2_ppb,
+        "SO2": so2_ppb,
+        "O3": o3_ppm,
+        "Temperature": temperature_celsius,
+        "Humidity": np.asarray(humidity, dtype=float),
+        "WindSpeed": np.asarray(wind_speed, dtype=float),
+    })
+
+    return aqi, features
 
 
 def run_health_impact_map_kriging (
     measurements: List[AirQualityMeasurement],
     bounds=PUGLIA_BOUNDS,
     resolution=50,
-    model = gb_model,
+    model = None,
     target_date=None,
     extra_info=False
 ):
+    from sklearn.gaussian_process import GaussianProcessRegressor
+    from sklearn.gaussian_process.kernels import RBF, WhiteKernel
+
+    model = model or ModelRegistry().get("gb_model")
+
     if target_date is None:
         target_date = datetime.today()
     else:
         target_date = pd.to_datetime(target_date)
 
 
-    coords = []
-    feature_dicts = []
-    for m in measurements:
-        if m.pollutants is None:
-            continue
-        coords.append([m.longitude, m.latitude])
-        pm25 = getattr(m.pollutants, "pm2_5_value", 0)
-        pm25_unit = getattr(m.pollutants, "pm2dot5_unit", "µg/m³")
+    stations = [m for m in measurements if m.pollutants is not None]
 
-        pm10 = getattr(m.pollutants, "pm10_value", 0)
-        pm10_unit = getattr(m.pollutants, "pm10_unit", "µg/m³")
+    coords = np.array([[m.longitude, m.latitude] for m in stations])
 
-        no2 = getattr(m.pollutants, "no2_value", 0)
-        no2_unit = getattr(m.pollutants, "no2_unit", "µg/m³")
+    def column(attr, default):
+        return np.array([getattr(m.pollutants, attr, default) for m in stations], dtype=float)
 
-        o3 = getattr(m.pollutants, "o3_value", 0)
-        o3_unit = getattr(m.pollutants, "o3_unit", "µg/m³")
+    def units(attr):
+        return np.array([getattr(m.pollutants, attr, "µg/m³") for m in stations])
 
-        so2 = getattr(m.pollutants, "so2_value", 0)
-        so2_unit = getattr(m.pollutants, "so2_unit", "µg/m³")
+    weather = [generate_single_day_forecast(m.latitude, m.longitude, target_date) for m in stations]
 
-        pm25_ug = convert_to_aqi_unit("PM2.5", pm25, pm25_unit)
-        pm10_ug = convert_to_aqi_unit("PM10", pm10, pm10_unit)
-        o3_ppm = convert_to_aqi_unit("O3", o3, o3_unit)
-        so2_ppb = convert_to_aqi_unit("SO2", so2, so2_unit)
-        no2_ppb = convert_to_aqi_unit("NO2", no2, no2_unit)
-
-
-        concentrations = {
-            "PM2.5": pm25_ug,  # µg/m³
-            "PM10": pm10_ug,   # µg/m³
-            "O3": o3_ppm,   # ppm
-            "SO2": so2_ppb, # ppb
-            "NO2": no2_ppb  # ppb
+    _, features_df = build_health_features(
+        pm25=column("pm2_5_value", 0),
+        pm10=column("pm10_value", 0),
+        no2=column("no2_value", 0),
+        o3=column("o3_value", 0),
+        so2=column("so2_value", 0),
+        temperature_kelvin=[w['temperature'] for w in weather],
+        humidity=[w['humidity'] for w in weather],
+        wind_speed=[w['wind_speed'] for w in weather],
+        units={
+            "PM2.5": units("pm2dot5_unit"),
+            "PM10": units("pm10_unit"),
+            "NO2": units("no2_unit"),
+            "O3": units("o3_unit"),
+            "SO2": units("so2_unit")
         }
-
-        aqi = calculate_aqi_overall(concentrations)
-
-        weather = generate_single_day_forecast(m.latitude, m.longitude, target_date)
-        temperature_kelvin = weather['temperature']
-        humidity = weather['humidity']
-        wind_speed = weather['wind_speed']
-
-        temperature_celsius = temperature_kelvin - 273.15
-
-        temperature_celsius = round(temperature_celsius, 1)
-
-        feature_dicts.append({
-            "AQI": aqi,
-            "PM10": pm10_ug,
-            "PM2_5": pm25_ug,
-            "NO2": no2_ppb,
-            "SO2": so2_ppb,
-            "O3": o3_ppm,
-            "Temperature": temperature_celsius,
-            "Humidity": humidity,
-            "WindSpeed": wind_speed,
-        })
-
-    features_df = pd.DataFrame(feature_dicts)
+    )
     features_df = features_df[model.feature_names_in_]
 
     health_index = model.predict(features_df)
-    
-    coords = np.array(coords)
 
 
     lon_grid, lat_grid, grid_coords = create_grid(bounds, resolution=resolution)
@@ -197,9 +244,8 @@ def run_health_impact_map_kriging (
     gp = GaussianProcessRegressor(kernel=kernel, alpha=1e-6, normalize_y=True)
     gp.fit(coords, health_index)
 
-    pred_values, std_values = gp.predict(grid_coords, return_std=True)
+    pred_values, _ = predict_on_grid(gp, grid_coords, bounds, resolution)
     pred_grid = pred_values.reshape(lon_grid.shape)
-    std_grid = std_values.reshape(lon_grid.shape)
 
     filename = generate_health_impact_map(
         lon_grid,
@@ -222,17 +268,28 @@ def generate_health_impact_map(
 ):
     os.makedirs(OUTPUT_DATAMAPS_HEALTH, exist_ok=True)
 
+    if target_date is None:
+        filename = os.path.abspath(
+        os.path.join(OUTPUT_DATAMAPS_HEALTH, "health_impact_map.png")
+        )
+    else:
+        date_str = pd.to_datetime(target_date).strftime("%Y-%m-%d")
+        filename = os.path.abspath(
+            os.path.join(OUTPUT_DATAMAPS_HEALTH, f"health_impact_map_{date_str}.png")
+        )
+
+    if not extra_info:
+        # Overlay trasparente: raster diretto NumPy -> PNG, senza figura cartopy
+        return render_overlay_png(pred_grid, bounds, filename, "YlOrRd")
+
+    import matplotlib.pyplot as plt
+    import cartopy.crs as ccrs
+
     plt.figure(figsize=(12, 10))
     ax = plt.axes(projection=ccrs.PlateCarree())
 
     ax.set_extent([bounds["west"], bounds["east"], bounds["south"], bounds["north"]])
 
-    ax.add_feature(cfeature.COASTLINE, linewidth=0.5)
-    if extra_info:
-        ax.add_feature(cfeature.BORDERS, linewidth=0.5)
-        ax.add_feature(cfeature.LAND, alpha=0.2, color="lightgray")
-        ax.add_feature(cfeature.OCEAN, alpha=0.2, color="lightblue")
-
     contour = ax.contourf(
         lon_grid,
         lat_grid,
@@ -243,6 +300,9 @@ def generate_health_impact_map(
         transform=ccrs.PlateCarree()
     )
 
+    # Costa, confini, terra e mare: layer rasterizzato in cache, niente geometrie Natural Earth
+    add_basemap_layer(ax, bounds, extra_info=extra_info)
+
     if extra_info:
         ax.scatter(
             coords[:, 0], coords[:, 1], c=values,
@@ -255,16 +315,6 @@ def generate_health_impact_map(
 
         ax.gridlines(draw_labels=True)
 
-    if target_date is None:
-        filename = os.path.abspath(
-        os.path.join(OUTPUT_DATAMAPS_HEALTH, "health_impact_map.png")
-        )
-    else:
-        date_str = pd.to_datetime(target_date).strftime("%Y-%m-%d")
-        filename = os.path.abspath(
-            os.path.join(OUTPUT_DATAMAPS_HEALTH, f"health_impact_map_{date_str}.png")
-        )
-
     plt.axis("off")
     plt.savefig(filename, dpi=300, bbox_inches="tight", pad_inches=0, transparent=not extra_info)
     plt.close()
@@ -1,16 +1,22 @@
 from fileinput import filename
 import os
 import numpy as np
-import matplotlib.pyplot as plt
-from sklearn.gaussian_process import GaussianProcessRegressor
-from sklearn.gaussian_process.kernels import RBF, WhiteKernel
-import cartopy.crs as ccrs
-import cartopy.feature as cfeature
 from models.domain import AirQualityMeasurement
 from config.constants import PUGLIA_BOUNDS, OUTPUT_DATAMAPS
 from typing import List
 from datetime import datetime
-from utils.trees_utils import generate_tree_gaussians
+from functools import lru_cache
+from utils.trees_utils import tree_absorption_field
+from utils.basemap_utils import render_overlay_png, add_basemap_layer
+from components.kriging_operator_cache import predict_on_grid, coords_hash, PredictionOperatorCache, build_prediction_operator
+from components.local_kriging import resolve_engine, run_local_kriging
+from components.kriging_state_store import (
+    load_kriging_state,
+    save_kriging_state,
+    is_state_fresh,
+    load_prediction_operator,
+    save_prediction_operator
+)
 
 def get_out_dir(output_dir=OUTPUT_DATAMAPS, region = "Puglia", overwrite=False):
     timestamp = datetime.now().isoformat()[:13].replace(":", "-") #* 16 for hrs
@@ -37,14 +43,43 @@ def extract_measurements_coords_and_values(
     return np.array(coords), np.array(values)
 
 
+def extract_measurements_coords_and_values_matrix(
+    measurements: List[AirQualityMeasurement], pollutants: List[str]
+):
+    """
+    Estrae le coordinate delle stazioni e una matrice (stazioni x inquinanti).
+    I valori mancanti sono NaN, cosi' ogni colonna conserva l'allineamento con le coordinate.
+    """
+    coords = []
+    rows = []
+    for m in measurements:
+        if m.pollutants is None:
+            print("m.pollutants is none")
+            continue
+        row = [getattr(m.pollutants, f"{pollutant}_value", None) for pollutant in pollutants]
+        if all(value is None for value in row):
+            continue
+        coords.append([m.longitude, m.latitude])
+        rows.append([np.nan if value is None else value for value in row])
+    return np.array(coords, dtype=float).reshape(-1, 2), np.array(rows, dtype=float).reshape(-1, len(pollutants))
+
+
 def create_grid(bounds, resolution=50):
-    """Crea griglia per interpolazione"""
-    lon_range = np.linspace(bounds["west"], bounds["east"], resolution)
-    lat_range = np.linspace(bounds["south"], bounds["north"], resolution)
+    """Crea griglia per interpolazione (in cache per bounds e risoluzione, sola lettura)"""
+    return _cached_grid(bounds["west"], bounds["east"], bounds["south"], bounds["north"], resolution)
+
+
+@lru_cache(maxsize=16)
+def _cached_grid(west, east, south, north, resolution):
+    lon_range = np.linspace(west, east, resolution)
+    lat_range = np.linspace(south, north, resolution)
     lon_grid, lat_grid = np.meshgrid(lon_range, lat_range)
 
     grid_coords = np.column_stack([lon_grid.ravel(), lat_grid.ravel()])
 
+    for grid in (lon_grid, lat_grid, grid_coords):
+        grid.setflags(write=False)
+
     return lon_grid, lat_grid, grid_coords
 
 
@@ -58,47 +93,71 @@ def run_kriging_on_measurements(
     noise=0.2,
     bounds=PUGLIA_BOUNDS,
     simulation_datas=None,
-    pollutant = None
+    pollutant = None,
+    engine="exact",
+    tree_field="kernel",
+    save_tree_map=True
 ):
+    """
+    engine: "exact" (GP completo), "local" (kriging locale su KD-tree, lineare nel numero di punti)
+    o "auto" (locale solo oltre LOCAL_KRIGING_AUTO_THRESHOLD punti).
+    tree_field: "kernel" calcola il campo degli alberi simulati come somma di gaussiane troncate,
+    "gp" usa il vecchio fit di un GP sui punti simulati (con l'engine scelto).
+    save_tree_map: salva anche la mappa del solo campo degli alberi in out/datamaps/TreesModel.
+    """
+    from sklearn.gaussian_process import GaussianProcessRegressor
+    from sklearn.gaussian_process.kernels import RBF, WhiteKernel
+
     bounds = bounds or PUGLIA_BOUNDS
 
     lon_grid, lat_grid, grid_coords = create_grid(bounds, resolution=resolution)
 
     kernel = RBF(length_scale=scale, length_scale_bounds=(lower_scale_bound, upper_scale_bound)) + WhiteKernel(noise_level=noise)
-    gp = GaussianProcessRegressor(kernel=kernel, alpha=1e-6, normalize_y=True)
-    gp.fit(coords, values)
-
-    predictions, std = gp.predict(grid_coords, return_std=True)
+    if resolve_engine(engine, len(coords)) == "local":
+        predictions, std = run_local_kriging(kernel, coords, values, grid_coords)
+    else:
+        gp = GaussianProcessRegressor(kernel=kernel, alpha=1e-6, normalize_y=True)
+        gp.fit(coords, values)
+        predictions, std = predict_on_grid(gp, grid_coords, bounds, resolution)
     pred_grid = predictions.reshape(lon_grid.shape)
     std_grid = std.reshape(lon_grid.shape)
 
     if simulation_datas is not None:
         sim_coords, sim_values = simulation_datas
+        absorption = float(np.mean(sim_values)) if len(sim_values) else 0.0
 
         oscillation = np.random.normal(loc=0, scale=0.01, size=len(sim_coords))
         sim_values = sim_values + oscillation
 
-        kernel_sim = RBF(length_scale=0.008, length_scale_bounds=(0.005, 0.02)) + WhiteKernel(noise_level=0.005)
-        gp_sim = GaussianProcessRegressor(kernel=kernel_sim, alpha=1e-6, normalize_y=True)
-        gp_sim.fit(sim_coords, sim_values)
-        sim_pred_grid, _ = gp_sim.predict(grid_coords, return_std=True)
+        if tree_field == "kernel":
+            sim_pred_grid = tree_absorption_field(lon_grid, lat_grid, sim_coords, absorption)
+        else:
+            kernel_sim = RBF(length_scale=0.008, length_scale_bounds=(0.005, 0.02)) + WhiteKernel(noise_level=0.005)
+            if resolve_engine(engine, len(sim_coords)) == "local":
+                sim_pred_grid, _ = run_local_kriging(kernel_sim, sim_coords, sim_values, grid_coords)
+            else:
+                gp_sim = GaussianProcessRegressor(kernel=kernel_sim, alpha=1e-6, normalize_y=True)
+                gp_sim.fit(sim_coords, sim_values)
+                sim_pred_grid, _ = gp_sim.predict(grid_coords, return_std=True)
         sim_pred_grid = sim_pred_grid.reshape(lon_grid.shape)
 
-        # Min e Max originali
-        min_val = np.min(sim_pred_grid)
-        max_val = np.max(sim_pred_grid)
+        if tree_field != "kernel":
+            # Min e Max originali
+            min_val = np.min(sim_pred_grid)
+            max_val = np.max(sim_pred_grid)
 
-        # Stretch con min a 0 e max invariato
-        sim_pred_grid = (sim_pred_grid - min_val) / (max_val - min_val) * max_val
+            # Stretch con min a 0 e max invariato
+            sim_pred_grid = (sim_pred_grid - min_val) / (max_val - min_val) * max_val
 
 
-        print("Genero Immagine ==============================================")
-        generate_kriging_map_image(
-            lon_grid, lat_grid, sim_pred_grid, 
-            sim_coords, sim_values, pollutant=pollutant, 
-            bounds=bounds, region="TreesModel", 
-            extra_info=True
-        )
+        if save_tree_map:
+            print("Genero Immagine ==============================================")
+            generate_kriging_map_image(
+                lon_grid, lat_grid, sim_pred_grid, 
+                sim_coords, sim_values, pollutant=pollutant, 
+                bounds=bounds, region="TreesModel", 
+                extra_info=True
+            )
 
         pred_grid = np.maximum(pred_grid - sim_pred_grid, 0)
 
@@ -108,17 +167,137 @@ def run_kriging_on_measurements(
     return lon_grid, lat_grid, pred_grid, std_grid, grid_coords
 
 
+def _stored_prediction_operator(state_key, group, key, kernel, X_train, grid_coords, L=None):
+    """
+    Operatore di predizione salvato su disco accanto allo stato del kriging (condiviso tra i
+    processi del pool e tra i batch); se manca o e' di un'altra chiave viene costruito e salvato.
+    """
+    operator = load_prediction_operator(state_key, group, key) if state_key else None
+    if operator is None:
+        operator = build_prediction_operator(kernel, X_train, grid_coords, L=L)
+        if state_key:
+            save_prediction_operator(state_key, group, key, operator)
+    return operator
+
+
+def run_multi_output_kriging(
+    coords,
+    values_matrix,
+    pollutants,
+    resolution=50,
+    scale=0.6,
+    lower_scale_bound=0.1,
+    upper_scale_bound=0.4,
+    noise=0.2,
+    bounds=PUGLIA_BOUNDS,
+    state_key=None,
+):
+    """
+    Kriging multi-output: un solo GP per insieme di stazioni e kernel.
+    Gli inquinanti misurati dalle stesse stazioni condividono ottimizzazione degli
+    iperparametri e fattorizzazione di Cholesky, e vengono risolti come colonne
+    di un'unica matrice. Ritorna {pollutant: (lon_grid, lat_grid, pred_grid, std_grid, grid_coords)}.
+
+    Con state_key (la regione) gli iperparametri vengono salvati su disco: se recenti si
+    riusano senza ottimizzare, altrimenti fanno da punto di partenza dell'ottimizzazione.
+    Anche l'operatore di predizione viene salvato accanto allo stato: un batch successivo
+    alle stesse stazioni lo riusa, in qualunque processo del pool venga eseguito.
+    """
+    from sklearn.gaussian_process import GaussianProcessRegressor
+    from sklearn.gaussian_process.kernels import RBF, WhiteKernel
+
+    bounds = bounds or PUGLIA_BOUNDS
+    kernel_config = (scale, lower_scale_bound, upper_scale_bound, noise)
+
+    lon_grid, lat_grid, grid_coords = create_grid(bounds, resolution=resolution)
+
+    # Raggruppa gli inquinanti per maschera di stazioni valide
+    groups = {}
+    for j, pollutant in enumerate(pollutants):
+        mask = ~np.isnan(values_matrix[:, j])
+        if not mask.any():
+            print(f"[run_multi_output_kriging] Nessun valore per '{pollutant}'")
+            continue
+        groups.setdefault(mask.tobytes(), (mask, []))[1].append(j)
+
+    cache = PredictionOperatorCache()
+    results = {}
+    for mask, columns in groups.values():
+        group = [pollutants[j] for j in columns]
+        X_train, y_train = coords[mask], values_matrix[mask][:, columns]
+
+        coords_digest = coords_hash(X_train)
+
+        kernel = RBF(length_scale=scale, length_scale_bounds=(lower_scale_bound, upper_scale_bound)) + WhiteKernel(noise_level=noise)
+        state = load_kriging_state(state_key, group, kernel_config) if state_key else None
+
+        if state is not None and is_state_fresh(state, coords_digest):
+            # Iperparametri ancora validi: nessuna ottimizzazione
+            # Stesse stazioni, cambiano solo i valori: operatore (e Cholesky) gia' in cache o su disco;
+            # altrimenti viene costruito con il kernel fissato. Una sola lookup per predizione
+            kernel = kernel.clone_with_theta(np.array(state["theta"]))
+            key = cache.make_key(bounds, resolution, X_train, kernel)
+            operator = cache.get_or_build(
+                key, lambda: _stored_prediction_operator(state_key, group, key, kernel, X_train, grid_coords)
+            )
+        else:
+            if state is not None:
+                # Stato scaduto o di altre stazioni: l'ottimizzazione parte dagli ultimi iperparametri
+                kernel = kernel.clone_with_theta(np.array(state["theta"]))
+            gp = GaussianProcessRegressor(kernel=kernel, alpha=1e-6, normalize_y=True)
+            gp.fit(X_train, y_train)
+
+            key = cache.make_key(bounds, resolution, X_train, gp.kernel_)
+            operator = cache.get_or_build(
+                key, lambda: _stored_prediction_operator(state_key, group, key, gp.kernel_, X_train, grid_coords, L=gp.L_)
+            )
+
+            if state_key:
+                save_kriging_state(state_key, group, kernel_config, gp.kernel_, coords_digest)
+
+        predictions, std = operator.predict(y_train)
+
+        predictions = predictions.reshape(len(grid_coords), -1)
+        std = np.broadcast_to(std.reshape(len(grid_coords), -1), predictions.shape)
+
+        for k, j in enumerate(columns):
+            pred_grid = predictions[:, k].reshape(lon_grid.shape)
+            std_grid = std[:, k].reshape(lon_grid.shape)
+            results[pollutants[j]] = (lon_grid, lat_grid, pred_grid, std_grid, grid_coords)
+
+    return results
+
+
 
 def generate_kriging_map_image(
     lon_grid, lat_grid, pred_grid, coords, values, pollutant, bounds = PUGLIA_BOUNDS, region = None, 
-    extra_info = False, sim_coords = None, zip_archive = False
+    extra_info = False, sim_coords = None, zip_archive = False, output = None
 ):
+    """output: path o file-like (es. BytesIO) dove scrivere il PNG; di default il file in out/datamaps"""
     region = region or "Puglia"
     bounds = bounds or PUGLIA_BOUNDS
-    os.makedirs(get_out_dir(region=region), exist_ok=True)
 
-    plt.figure(figsize=(12, 10))
-    ax = plt.axes(projection=ccrs.PlateCarree())
+    if output is not None:
+        filename = output
+    else:
+        os.makedirs(get_out_dir(region=region), exist_ok=True)
+        filename = os.path.abspath(
+            os.path.join(get_out_dir(region=region, overwrite=zip_archive), f"kriging_map_{pollutant.lower()}.png")
+        ) 
+
+    if not extra_info:
+        # Overlay trasparente: raster diretto NumPy -> PNG, senza figura cartopy
+        return render_overlay_png(pred_grid, bounds, filename, "viridis")
+
+    # Solo la mappa annotata richiede matplotlib e cartopy. Figure + canvas Agg senza pyplot:
+    # nessuno stato globale, si puo' renderizzare da piu' thread (simulazioni in streaming)
+    import cartopy.crs as ccrs
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure(figsize=(12, 10))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(1, 1, 1, projection=ccrs.PlateCarree())
 
     ax.set_extent(
         [
@@ -129,13 +308,6 @@ def generate_kriging_map_image(
         ]
     )
 
-    ax.add_feature(cfeature.COASTLINE, linewidth=0.5)
-    
-    if extra_info:
-        ax.add_feature(cfeature.BORDERS, linewidth=0.5)
-        ax.add_feature(cfeature.LAND, alpha=0.2, color="lightgray")
-        ax.add_feature(cfeature.OCEAN, alpha=0.2, color="lightblue")
-
     contour = ax.contourf(
         lon_grid,
         lat_grid,
@@ -146,6 +318,9 @@ def generate_kriging_map_image(
         transform=ccrs.PlateCarree(),
     )
 
+    # Costa, confini, terra e mare: layer rasterizzato in cache, niente geometrie Natural Earth
+    add_basemap_layer(ax, bounds, extra_info=extra_info)
+
     if extra_info:
 
         ax.scatter(
@@ -174,16 +349,11 @@ def generate_kriging_map_image(
             zorder=5,
         )
 
-        cbar = plt.colorbar(contour, ax=ax, shrink=0.7, pad=0.03)
+        cbar = fig.colorbar(contour, ax=ax, shrink=0.7, pad=0.03)
         cbar.set_label(f"{pollutant.upper()} (μg/m³)", rotation=270, labelpad=15)
 
         ax.gridlines(draw_labels=True)
 
-    filename = os.path.abspath(
-        os.path.join(get_out_dir(region=region, overwrite=zip_archive), f"kriging_map_{pollutant.lower()}.png")
-    ) 
-
-    plt.axis("off")
-    plt.savefig(filename, dpi=300, bbox_inches="tight", pad_inches=0, transparent= not extra_info)
-    plt.close()
+    ax.axis("off")
+    fig.savefig(filename, format="png", dpi=300, bbox_inches="tight", pad_inches=0, transparent= not extra_info)
     return filename
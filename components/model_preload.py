@@ -0,0 +1,33 @@
+import gc
+import time
+from modules.model_registry import ModelRegistry
+
+# Artefatti senza stato di runtime (pickle sklearn/pandas): sicuri da caricare prima del fork
+FORK_SAFE_MODELS = ("gb_model", "weather_stats")
+
+# TensorFlow non sopravvive al fork (thread pool e runtime): mai nel master; caricato nel worker
+# all'avvio solo con GUNICORN_PRELOAD_FORECASTER=true, altrimenti al primo utilizzo
+WORKER_MODELS = ("forecaster",)
+
+
+def preload_models():
+    """
+    Carica gb_model e le statistiche meteo nel processo master di gunicorn, prima del fork:
+    i worker li ereditano gia' in memoria (copy-on-write).
+    Importa solo i moduli dei modelli, nessun client Mongo e nessun runtime TensorFlow prima del fork.
+    """
+    start = time.perf_counter()
+
+    registry = ModelRegistry()
+    registry.preload(FORK_SAFE_MODELS)
+
+    # Gli oggetti caricati finora non vengono piu' visitati dal GC: le pagine restano condivise nei worker
+    gc.freeze()
+    print(f"[preload_models] Modelli caricati in {time.perf_counter() - start:.1f}s: {registry.stats()['loaded']}")
+
+
+def load_worker_models():
+    """Modelli da caricare nel worker dopo il fork (il forecaster Keras)"""
+    start = time.perf_counter()
+    ModelRegistry().preload(WORKER_MODELS)
+    print(f"[load_worker_models] Modelli del worker caricati in {time.perf_counter() - start:.1f}s")
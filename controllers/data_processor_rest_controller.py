@@ -1,12 +1,27 @@
-from flask import Blueprint, request, jsonify, make_response
-from models.dto import AirQualityMeasurementDTO, MeasurementResponseDTO, DataMapResponseDTO, DataMapDTO
+from flask import Blueprint, request, jsonify
+from models.dto import AirQualityMeasurementDTO, MeasurementResponseDTO, DataMapResponseDTO
 from repositories.pollution_measurement_repository import PollutionMeasurementsRepository
 from repositories.datamap_repository import DatamapRepository
+from repositories.index_manager import IndexManager
 from utils.token_utils import get_auth_params
+from utils.latest_datamap_cache import latest_datamap_response, GenerationTTLCache
+from utils.grid_store import query_grid_values
+from datetime import datetime
 
 
 measurements_bp = Blueprint("measurements", __name__)
 measurement_repository = PollutionMeasurementsRepository()
+# Datamap con griglia piu' recente per (inquinante, regione), rinnovata solo quando ne arriva una nuova
+latest_grid_cache = GenerationTTLCache(lambda: DatamapRepository().get_generation())
+
+
+def _get_query_points():
+    """Punti della richiesta: ?lat=&lon= ripetibili, oppure JSON {"points": [{"lat", "lon"}]}"""
+    if request.method == "POST":
+        data = request.get_json() or {}
+        points = data.get("points", [])
+        return [float(p["lat"]) for p in points], [float(p["lon"]) for p in points], data
+    return [float(v) for v in request.args.getlist("lat")], [float(v) for v in request.args.getlist("lon")], request.args
 
 
 @measurements_bp.route("/measurements/datamap/latest/<pollutant>", methods=["GET"])
@@ -23,29 +38,88 @@ def get_last_datamap(pollutant):
     try:
         if pollutant.lower() == "pm2.5":
             pollutant = "pm2dot5"
+        return latest_datamap_response(pollutant.lower())
+    except Exception as e:
+        return jsonify(DataMapResponseDTO(response=1, message=f"{e}").to_dict()), 400
+
+
+
+@measurements_bp.route("/measurements/indexes", methods=["GET"])
+def get_index_usage():
+
+    token = get_auth_params(request)
+    if token.get("role") != "ADMIN":
+        return jsonify({"msg":"Token non valido"}), 403
+
+    '''
+    Utilizzo degli indici e collection scan, per verificare che le query non facciano scan
+    '''
+
+    try:
+        return jsonify({
+            "status": "success",
+            "data": IndexManager().index_usage()
+        }), 200
+    except Exception as e:
+        return jsonify({"status": "error", "message": f"{e}", "data": {}}), 500
+
+
+@measurements_bp.route("/measurements/value/<pollutant>", methods=["GET", "POST"])
+def get_pollutant_value(pollutant):
+
+    token = get_auth_params(request)
+    if not (token.get("role") == "ADMIN" or token.get("role") == "REGULAR" or token.get("role") == "RESEARCHER" ) :
+        return jsonify({"msg":"Token non valido"}), 403
+
+    '''
+    Valore interpolato dell'inquinante nei punti richiesti, dalla griglia dell'ultima datamap
+    (o dell'ultima fino a date), senza rifare il kriging
+    '''
+
+    try:
+        lats, lons, params = _get_query_points()
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"status": "error", "message": "lat e lon devono essere numerici", "data": {}}), 400
+    if not lats or len(lats) != len(lons):
+        return jsonify({"status": "error", "message": "Servono lat e lon, in egual numero", "data": {}}), 400
+
+    date = params.get("date")
+    if date:
+        try:
+            date = datetime.fromisoformat(str(date))
+        except ValueError:
+            return jsonify({"status": "error", "message": f"Formato data non valido: {date}. Utilizzare ISO 8601", "data": {}}), 400
+
+    try:
+        pollutant = "pm2dot5" if pollutant.lower() == "pm2.5" else pollutant.lower()
+        region = params.get("region", "Puglia")
+
         repo = DatamapRepository()
-        latest = repo.find_latest_measurement(pollutant=pollutant.lower())
-        
+        if date:
+            datamap = repo.find_latest_with_grid(pollutant, region=region, before=date)
+        else:
+            datamap = latest_grid_cache.get_or_load(
+                (pollutant, region), lambda: repo.find_latest_with_grid(pollutant, region=region)
+            )
 
-        if not latest:
+        if not datamap:
             return jsonify({
                 "status": "error",
-                "message": "Nessuna datamap trovata",
+                "message": "Nessuna datamap con griglia trovata",
                 "data": {}
             }), 404
 
-        
-        dto = DataMapDTO.from_domain(latest)
-
-        return jsonify(DataMapResponseDTO(
-                response=0,
-                message="Datamap recuperata correttamente",
-                payload=[dto]
-            ).to_dict()
-        ), 200 
+        return jsonify({
+            "status": "success",
+            "data": {
+                "pollutant": pollutant,
+                "region": datamap.region,
+                "date": datamap.date.isoformat(),
+                "values": query_grid_values(datamap.pred_grid_path, datamap.std_grid_path, datamap.bounds, lats, lons)
+            }
+        }), 200
     except Exception as e:
-        return jsonify(DataMapResponseDTO(response=1, message=f"{e}").to_dict()), 400
-
+        return jsonify({"status": "error", "message": f"{e}", "data": {}}), 500
 
 
 @measurements_bp.route("/measurements", methods=["POST"])
@@ -1,11 +1,134 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, jsonify, request, send_file
+from werkzeug.utils import safe_join
+from functools import lru_cache
 import os
 import base64
 from utils.token_utils import get_auth_params
+from utils.grid_store import get_grid_paths, load_grid_meta, query_grid_values
+from config.constants import OUTPUT_DATAMAPS, OUTPUT_DATAMAPS_HEALTH, IMAGE_CACHE_MAX_AGE, IMAGE_BASE64_CACHE_SIZE
 
 
 images_bp = Blueprint("images", __name__)
 
+
+def _resolve_image(directory, *parts):
+    """Path dell'immagine dentro directory, None se fuori dalla cartella o inesistente"""
+    file_path = safe_join(directory, *parts)
+    if file_path is None or not os.path.isfile(file_path):
+        return None
+    return file_path
+
+
+@lru_cache(maxsize=IMAGE_BASE64_CACHE_SIZE)
+def _encode_base64(file_path, mtime_ns, size):
+    # mtime e dimensione fanno parte della chiave: un file riscritto viene ricodificato
+    with open(file_path, "rb") as image_file:
+        return base64.b64encode(image_file.read()).decode('utf-8')
+
+
+def _base64_response(file_path):
+    if file_path is None:
+        return jsonify({"error": "File not found", "code":1}), 200
+    st = os.stat(file_path)
+    return jsonify({"image_base64": _encode_base64(file_path, st.st_mtime_ns, st.st_size), "code":0})
+
+
+def _send_image(file_path):
+    """
+    PNG in binario: file servito in streaming (sendfile se il server lo supporta),
+    ETag forte da mtime e dimensione, 304 su If-None-Match, richieste Range e Cache-Control.
+    """
+    if file_path is None:
+        return jsonify({"error": "File not found", "code":1}), 404
+    st = os.stat(file_path)
+    return send_file(
+        file_path,
+        mimetype="image/png",
+        conditional=True,
+        etag=f"{st.st_mtime_ns:x}-{st.st_size:x}",
+        max_age=IMAGE_CACHE_MAX_AGE
+    )
+
+
+def _has_image_role(token):
+    return token.get("role") == "ADMIN" or token.get("role") == "REGULAR" or token.get("role") == "RESEARCHER"
+
+
+@images_bp.route("/images/raw/<region>/<date>/<hour>/<filename>", methods=["GET"])
+def serve_image_raw(region, date, hour, filename):
+
+    token = get_auth_params(request)
+    if not _has_image_role(token):
+        return jsonify({"msg":"Token non valido"}), 403
+
+    try:
+        return _send_image(_resolve_image(OUTPUT_DATAMAPS, region, f"{date}T{hour}", filename))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@images_bp.route("/images/tiles/<region>/<date>/<hour>/<pollutant>/<int:z>/<int:x>/<int:y>.png", methods=["GET"])
+def serve_tile(region, date, hour, pollutant, z, x, y):
+
+    token = get_auth_params(request)
+    if not _has_image_role(token):
+        return jsonify({"msg":"Token non valido"}), 403
+
+    try:
+        # Le tile vuote non vengono scritte: 404 e il client non disegna nulla
+        return _send_image(_resolve_image(
+            OUTPUT_DATAMAPS, region, f"{date}T{hour}", "tiles", pollutant.lower(), str(z), str(x), f"{y}.png"
+        ))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@images_bp.route("/images/values/<region>/<date>/<hour>/<pollutant>", methods=["GET"])
+def serve_grid_values(region, date, hour, pollutant):
+
+    token = get_auth_params(request)
+    if not _has_image_role(token):
+        return jsonify({"msg":"Token non valido"}), 403
+
+    '''
+    Valori interpolati della mappa nei punti ?lat=&lon= (ripetibili), letti dalla griglia salvata
+    '''
+
+    try:
+        lats = [float(v) for v in request.args.getlist("lat")]
+        lons = [float(v) for v in request.args.getlist("lon")]
+    except ValueError:
+        return jsonify({"error": "lat e lon devono essere numerici", "code":1}), 400
+    if not lats or len(lats) != len(lons):
+        return jsonify({"error": "Servono lat e lon, in egual numero", "code":1}), 400
+
+    try:
+        image_path = safe_join(OUTPUT_DATAMAPS, region, f"{date}T{hour}", f"kriging_map_{pollutant.lower()}.png")
+        paths = get_grid_paths(image_path) if image_path else None
+        if paths is None or not os.path.isfile(paths["meta"]):
+            return jsonify({"error": "Griglia non trovata", "code":1}), 404
+
+        meta = load_grid_meta(paths["meta"])
+        return jsonify({
+            "values": query_grid_values(paths["pred"], paths["std"], meta["bounds"], lats, lons),
+            "code": 0
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@images_bp.route("/images/health/raw/<filename>", methods=["GET"])
+def serve_image_health_raw(filename):
+
+    token = get_auth_params(request)
+    if not _has_image_role(token):
+        return jsonify({"msg":"Token non valido"}), 403
+
+    try:
+        return _send_image(_resolve_image(OUTPUT_DATAMAPS_HEALTH, filename))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @images_bp.route("/images/<region>/<date>/<hour>/<filename>", methods=["GET"])
 def serve_image(region, date, hour, filename):
     
@@ -14,13 +137,7 @@ def serve_image(region, date, hour, filename):
         return jsonify({"msg":"Token non valido"}), 403
     
     try:
-        file_path = f"./out/datamaps/{region}/{date}T{hour}/{filename}"
-        if os.path.exists(file_path):
-            with open(file_path, "rb") as image_file:
-                encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-                return jsonify({"image_base64": encoded_string, "code":0})
-        else:
-            return jsonify({"error": "File not found", "code":1}), 200
+        return _base64_response(_resolve_image(OUTPUT_DATAMAPS, region, f"{date}T{hour}", filename))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -34,13 +151,7 @@ def serve_image_health(filename):
         return jsonify({"msg":"Token non valido"}), 403
     
     try:
-        file_path = f"./out/datamaps/datamapsHealth/{filename}"
-        if os.path.exists(file_path):
-            with open(file_path, "rb") as image_file:
-                encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-                return jsonify({"image_base64": encoded_string, "code":0})
-        else:
-            return jsonify({"error": "File not found", "code":1}), 200
+        return _base64_response(_resolve_image(OUTPUT_DATAMAPS_HEALTH, filename))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
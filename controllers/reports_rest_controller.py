@@ -1,7 +1,6 @@
 from flask import Blueprint, jsonify, request
 from repositories.pollution_measurement_repository import PollutionMeasurementsRepository
-from statistics import median
-from collections import defaultdict
+from config.constants import REPORT_GRANULARITIES
 
 reports_bp = Blueprint("reports", __name__)
 
@@ -12,37 +11,32 @@ from flask import jsonify
 
 @reports_bp.route("/reports/<pollutant>/<start_date>/<finish_date>", methods=["GET"])
 def get_measurement_report(pollutant, start_date, finish_date):
+    granularity = request.args.get("granularity")
+    if granularity is not None and granularity not in REPORT_GRANULARITIES:
+        return jsonify({
+            "status": "error",
+            "message": f"granularity deve essere uno tra {', '.join(REPORT_GRANULARITIES)}",
+            "data": {}
+        }), 400
+
     try:
-        measurements = measurementRepository.find_between_dates(start_date, finish_date)
+        # Raggruppamento e mediana calcolati da MongoDB: torna solo la serie data/valore
+        dates, values = measurementRepository.aggregate_median_series(
+            pollutant, start_date, finish_date, granularity=granularity
+        )
 
-        if not measurements:
+        # 404 solo senza misure nell'intervallo; se manca solo l'inquinante la serie e' vuota
+        if not dates and not measurementRepository.has_measurements_between(start_date, finish_date):
             return jsonify({
                 "status": "error",
                 "message": "Nessuna misurazione trovata",
                 "data": {}
             }), 404
 
-        field_name = f"{pollutant}_value"
-
-        grouped = defaultdict(list)
-
-        for m in measurements:
-            dt_key = m.misuration_date.isoformat()
-            value = getattr(m.pollutants, field_name, None)
-            if value is not None:
-                grouped[dt_key].append(value)
-
-        dates = []
-        values = []
-
-        for dt_key in sorted(grouped.keys()):
-            dates.append(dt_key)
-            values.append(median(grouped[dt_key]))
-
         return jsonify({
             "status": "success",
             "data": {
-                "dates": dates,
+                "dates": [d.isoformat() for d in dates],
                 "values": values
             }
         })
@@ -1,51 +1,30 @@
 from datetime import datetime, date
+import os
+import shutil
 from flask import Blueprint, jsonify, request
 from repositories.pollution_measurement_repository import PollutionMeasurementsRepository
-from repositories.datamap_repository import DatamapRepository
-from models.dto import AirQualityMeasurementDTO, MeasurementResponseDTO, DataMapResponseDTO, DataMapDTO
-import joblib
-import pandas as pd
+from models.dto import DataMapResponseDTO
 import numpy as np
-from utils.health_utils import generate_single_day_forecast, prediction_measuraments
-from components.model_inference_health_service  import convert_to_aqi_unit, calculate_aqi_overall, create_grid, generate_health_impact_map
-from config.constants import PUGLIA_BOUNDS, OUTPUT_DATAMAPS_HEALTH
-from sklearn.gaussian_process import GaussianProcessRegressor
-from sklearn.gaussian_process.kernels import RBF, WhiteKernel
-from sklearn.cluster import DBSCAN
+from utils.health_utils import generate_single_day_forecast, prediction_measuraments_batch
+from components.model_inference_health_service  import build_health_features, create_grid, generate_health_impact_map
+from components.kriging_operator_cache import predict_on_grid
+from config.constants import PUGLIA_BOUNDS, HEALTH_MODEL_ARTIFACTS
 from utils.token_utils import get_auth_params
+from utils.latest_datamap_cache import latest_datamap_response
+from utils.result_cache import ResultCache, digest_of, artifact_versions, make_result_key, load_payload
+from modules.model_registry import ModelRegistry
 
 health_simulation_bp = Blueprint("health_simulation", __name__)
 
 measurementRepository = PollutionMeasurementsRepository()
 
-with open('models/gb_model.pkl', 'rb') as f:
-    gb_model = joblib.load(f)
-
 @health_simulation_bp.route("/health-simulation/datamap/latest", methods=["GET"])
 def get_latest_datamap_health():
     token = get_auth_params(request)
     if not (token.get("role") == "ADMIN" or token.get("role") == "RESEARCHER" ) :
         return jsonify({"msg":"Token non valido"}), 403
     try:
-        repo = DatamapRepository()
-        latest = repo.find_latest_measurement(pollutant="health_index")
-
-        if not latest:
-            return jsonify({
-                "status": "error",
-                "message": "Nessuna datamap trovata",
-                "data": {}
-            }), 404
-
-        
-        dto = DataMapDTO.from_domain(latest)
-
-        return jsonify(DataMapResponseDTO(
-                response=0,
-                message="Datamap recuperata correttamente",
-                payload=[dto]
-            ).to_dict()
-        ), 200 
+        return latest_datamap_response("health_index")
     except Exception as e:
         return jsonify(DataMapResponseDTO(response=1, message=f"{e}").to_dict()), 400
 
@@ -84,13 +63,29 @@ def run_prediction_health():
             "status": "error",
             "message": f"Formato data non valido: {date_str}. Utilizzare YYYY-MM-DD"
         }), 400
+
+    # Stessa data, stesse stazioni e stessi modelli: risposta e mappa dalla cache dei risultati
+    cache = ResultCache()
+    cache_key = make_result_key(
+        "health-simulation",
+        {"date": target_date.isoformat()},
+        digest_of(sorted(coords)),
+        artifact_versions(HEALTH_MODEL_ARTIFACTS)
+    )
+    entry = cache.get(cache_key)
+    if entry is not None:
+        payload = load_payload(entry)
+        restore_cached_map(entry, payload["filename"])
+        return jsonify(payload), 200
     
     predictions = []
-    feature_dicts = []
+    health_stations = []
     successful_coords = []
 
     coords = np.array(coords)
 
+    from sklearn.cluster import DBSCAN
+
     # Clustering
     clustering = DBSCAN(eps=0.21, min_samples=1).fit(coords)
     labels = clustering.labels_
@@ -104,14 +99,20 @@ def run_prediction_health():
 
     unique_coords = np.array(unique_coords)
 
-    for i, coord in enumerate(unique_coords):
+    # Un solo rollout del modello per tutti i centroidi
+    try:
+        batch_predictions = prediction_measuraments_batch(target_date, [tuple(coord) for coord in unique_coords])
+    except Exception as batch_error:
+        batch_predictions = [batch_error] * len(unique_coords)
+
+    for i, (coord, prediction) in enumerate(zip(unique_coords, batch_predictions)):
         longitude, latitude = coord
-        spatial_target = [longitude, latitude]
 
         print(f"Processando coordinata {i+1}/{len(unique_coords)}: {coord}")
         
         try:
-            prediction = prediction_measuraments(target_date, spatial_target)
+            if isinstance(prediction, Exception):
+                raise prediction
             print(prediction)
 
             if not prediction or not isinstance(prediction, dict):
@@ -132,20 +133,8 @@ def run_prediction_health():
             }
 
 
-            try:
-                print(f"Tentativo calcolo health index per coordinata {i+1}")
-                
-                input_station = prediction_health_index(latitude, longitude, target_date, prediction_station)
-                
-                feature_dicts.append(input_station)
-                successful_coords.append(coord)
-                
-            except Exception as health_error:
-                print(f"ERRORE nel calcolo health index per coordinata {i+1}:")
-                print(f"Tipo errore: {type(health_error).__name__}")
-                print(f"Messaggio: {str(health_error)}")
-                import traceback
-                print(f"Traceback: {traceback.format_exc()}")
+            health_stations.append(prediction_station)
+            successful_coords.append(coord)
             
             predictions.append(prediction_station)
                         
@@ -160,28 +149,32 @@ def run_prediction_health():
                 "error": str(prediction_error)
             })
 
-    if not feature_dicts:
+    if not health_stations:
         return jsonify({
             "status": "error",
             "message": "Nessuna predizione valida ottenuta per il calcolo dell'indice di salute"
         }), 500
 
     try:
-        features_df = pd.DataFrame(feature_dicts)
+        gb_model = ModelRegistry().get("gb_model")
+        features_df = prediction_health_features(target_date, health_stations)
         features_df = features_df[gb_model.feature_names_in_]
         health_index = gb_model.predict(features_df)
 
         coords_for_map = np.array(successful_coords)
         filename = generate_map(coords_for_map, health_index, target_date)
 
-        return jsonify({
+        payload = {
             "status": "success",
             "filename": filename,
             "data": {
                 "target_date": date_str,
                 "predictions": predictions
             }
-        }), 200
+        }
+        cache.put(cache_key, {os.path.basename(filename): filename}, payload=payload)
+
+        return jsonify(payload), 200
 
     except Exception as model_error:
         print(f"Errore nel modello o nella generazione della mappa: {str(model_error)}")
@@ -191,64 +184,51 @@ def run_prediction_health():
         }), 500
 
 
-def prediction_health_index(latitude, longitude, target_date, predictions):
-    weather = generate_single_day_forecast(latitude, longitude, target_date)
-    temperature_kelvin = weather['temperature']
-    humidity = weather['humidity']
-    wind_speed = weather['wind_speed']
-
-    temperature_celsius = temperature_kelvin - 273.15
-    temperature_celsius = round(temperature_celsius, 1)
-
-    pm25 = predictions["pollutants"]["pm2_5"]
-    pm10 = predictions["pollutants"]["pm10"]
-    no2  = predictions["pollutants"]["no2"]
-    o3   = predictions["pollutants"]["o3"]
-    so2  = predictions["pollutants"]["so2"]
-
-    pm25_ug = convert_to_aqi_unit("PM2.5", pm25, "µg/m³")
-    pm10_ug = convert_to_aqi_unit("PM10", pm10, "µg/m³")
-    o3_ppm = convert_to_aqi_unit("O3", o3, "µg/m³")
-    so2_ppb = convert_to_aqi_unit("SO2", so2, "µg/m³")
-    no2_ppb = convert_to_aqi_unit("NO2", no2, "µg/m³")
-
-
-    concentrations = {
-        "PM2.5": pm25_ug,  # µg/m³
-        "PM10": pm10_ug,   # µg/m³
-        "O3": o3_ppm,   # ppm
-        "SO2": so2_ppb, # ppb
-        "NO2": no2_ppb  # ppb
-    }
-
-    aqi = calculate_aqi_overall(concentrations)
-
-    input_model = {
-        "AQI": aqi,
-        "PM10": pm10_ug,
-        "PM2_5": pm25_ug,
-        "NO2": no2_ppb,
-        "SO2": so2_ppb,
-        "O3": o3_ppm,
-        "Temperature": temperature_celsius,
-        "Humidity": humidity,
-        "WindSpeed": wind_speed,
-    }
+def restore_cached_map(entry, filename):
+    """Ripristina la mappa in cache nel path atteso dal client (che puo' averla cancellata)"""
+    if not os.path.isfile(filename):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        shutil.copyfile(os.path.join(entry, os.path.basename(filename)), filename)
+
+
+def prediction_health_features(target_date, stations):
+    """Matrice delle feature del gb_model per tutte le stazioni predette"""
+    weather = [
+        generate_single_day_forecast(s["coordinates"]["latitude"], s["coordinates"]["longitude"], target_date)
+        for s in stations
+    ]
+
+    def column(pollutant):
+        return [s["pollutants"][pollutant] for s in stations]
+
+    _, features_df = build_health_features(
+        pm25=column("pm2_5"),
+        pm10=column("pm10"),
+        no2=column("no2"),
+        o3=column("o3"),
+        so2=column("so2"),
+        temperature_kelvin=[w['temperature'] for w in weather],
+        humidity=[w['humidity'] for w in weather],
+        wind_speed=[w['wind_speed'] for w in weather],
+        units="µg/m³"
+    )
 
-    return input_model
+    return features_df
 
 
 
 def generate_map(coords, health_index, target_date):
+    from sklearn.gaussian_process import GaussianProcessRegressor
+    from sklearn.gaussian_process.kernels import RBF, WhiteKernel
+
     lon_grid, lat_grid, grid_coords = create_grid(PUGLIA_BOUNDS, resolution=50)
 
     kernel = RBF(length_scale=0.6, length_scale_bounds=(0.1, 0.4)) + WhiteKernel(noise_level=0.2)
     gp = GaussianProcessRegressor(kernel=kernel, alpha=1e-6, normalize_y=True)
     gp.fit(coords, health_index)
 
-    pred_values, std_values = gp.predict(grid_coords, return_std=True)
+    pred_values, _ = predict_on_grid(gp, grid_coords, PUGLIA_BOUNDS, 50)
     pred_grid = pred_values.reshape(lon_grid.shape)
-    std_grid = std_values.reshape(lon_grid.shape)
 
     filename = generate_health_impact_map(
         lon_grid,
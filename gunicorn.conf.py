@@ -0,0 +1,40 @@
+import os
+
+# Avvio in produzione: gunicorn -c gunicorn.conf.py
+wsgi_app = "app:create_app()"
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8080")
+
+workers = int(os.getenv("GUNICORN_WORKERS", 2))
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+worker_class = "gthread"
+
+# Kriging e simulazioni sincrone possono richiedere minuti
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 300))
+graceful_timeout = 30
+
+accesslog = "-"
+errorlog = "-"
+
+# L'app viene creata in ogni worker dopo il fork (i client Mongo non sono fork-safe).
+# gb_model e statistiche meteo vengono caricati una volta nel master e condivisi.
+# Il forecaster TensorFlow non e' fork-safe e occupa memoria in ogni worker: di default
+# viene caricato alla prima richiesta che lo usa, GUNICORN_PRELOAD_FORECASTER=true lo carica
+# in ogni worker all'avvio
+PRELOAD_MODELS = os.getenv("GUNICORN_PRELOAD_MODELS", "true").lower() == "true"
+PRELOAD_FORECASTER = os.getenv("GUNICORN_PRELOAD_FORECASTER", "false").lower() == "true"
+
+
+def on_starting(server):
+    if PRELOAD_MODELS:
+        from components.model_preload import preload_models
+        preload_models()
+
+
+def post_fork(server, worker):
+    server.log.info(f"Worker {worker.pid} avviato ({threads} thread)")
+
+
+def post_worker_init(worker):
+    if PRELOAD_FORECASTER:
+        from components.model_preload import load_worker_models
+        load_worker_models()
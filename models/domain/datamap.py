@@ -1,5 +1,6 @@
 from dataclasses import dataclass
 from datetime import datetime
+from typing import Optional
 
 @dataclass
 class DataMap:
@@ -7,13 +8,23 @@ class DataMap:
     pollutant: str
     url: str
     region:str
+    tiles_path: Optional[str] = None  # cartella <z>/<x>/<y>.png della piramide XYZ
+    pred_grid_path: Optional[str] = None  # .npy float32, righe da sud a nord
+    std_grid_path: Optional[str] = None
+    bounds: Optional[dict] = None
+    resolution: Optional[int] = None
 
     def to_dict(self) -> dict:
         return {
             "date": self.date,  
             "pollutant": self.pollutant,
             "url": self.url,
-            "region": self.region
+            "region": self.region,
+            "tiles_path": self.tiles_path,
+            "pred_grid_path": self.pred_grid_path,
+            "std_grid_path": self.std_grid_path,
+            "bounds": self.bounds,
+            "resolution": self.resolution
         }
 
     @classmethod
@@ -22,5 +33,10 @@ class DataMap:
             date=datetime.fromisoformat(data["date"]) if isinstance(data["date"], str) else data["date"],  # <-- parsing ISO
             pollutant=data["pollutant"],
             url=data["url"],
-            region=data["region"]
+            region=data["region"],
+            tiles_path=data.get("tiles_path"),
+            pred_grid_path=data.get("pred_grid_path"),
+            std_grid_path=data.get("std_grid_path"),
+            bounds=data.get("bounds"),
+            resolution=data.get("resolution")
         )
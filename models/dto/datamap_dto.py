@@ -11,6 +11,7 @@ class DataMapDTO:
     region: str
     opacity: float
     attribution: Optional[str] = None
+    tiles_path: Optional[str] = None
 
     def to_dict(self) -> dict:
         return {
@@ -19,7 +20,8 @@ class DataMapDTO:
             "url": self.url,
             "region": self.region,
             "opacity": self.opacity,
-            "attribution": self.attribution
+            "attribution": self.attribution,
+            "tiles_path": self.tiles_path
         }
 
     @classmethod
@@ -30,7 +32,8 @@ class DataMapDTO:
             url=data["url"],
             region=data["region"],
             opacity=data["opacity"],
-            attribution=data.get("attribution")
+            attribution=data.get("attribution"),
+            tiles_path=data.get("tiles_path")
         )
 
     @classmethod
@@ -41,7 +44,8 @@ class DataMapDTO:
             url=domain.url,
             region=domain.region,
             opacity=getattr(domain, "opacity", 1.0),  # fallback se non presente
-            attribution=getattr(domain, "attribution", None)
+            attribution=getattr(domain, "attribution", None),
+            tiles_path=domain.tiles_path
         )
 
     def to_domain(self) -> DataMap:
@@ -49,5 +53,6 @@ class DataMapDTO:
             date=datetime.datetime.fromisoformat(self.date),
             pollutant=self.pollutant,
             url=self.url,
-            region=self.region
+            region=self.region,
+            tiles_path=self.tiles_path
         )
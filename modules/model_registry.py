@@ -0,0 +1,89 @@
+import sys
+import time
+import threading
+import importlib
+from modules.singleton import singleton
+
+# Librerie pesanti che il processo web non deve importare finche' un endpoint non le usa
+HEAVY_MODULES = ("tensorflow", "cartopy", "sklearn", "matplotlib.pyplot", "joblib")
+
+_import_times = {}
+
+
+def _load_gb_model():
+    import joblib
+    with open("models/gb_model.pkl", "rb") as f:
+        return joblib.load(f)
+
+
+def _load_forecaster():
+    from utils.health_utils import ForecastingEngine
+    return ForecastingEngine()
+
+
+def _load_weather_stats():
+    from utils.health_utils import get_weather_stats_store
+    return get_weather_stats_store()
+
+
+@singleton
+class ModelRegistry:
+    """
+    Modelli e artefatti caricati al primo utilizzo (una volta per processo, thread-safe):
+    import di TensorFlow, sklearn e joblib avvengono solo con il primo get().
+    """
+
+    def __init__(self):
+        self._loaders = {
+            "gb_model": _load_gb_model,
+            "forecaster": _load_forecaster,
+            "weather_stats": _load_weather_stats,
+        }
+        self._models = {}
+        self._load_times = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, loader):
+        self._loaders[name] = loader
+
+    def get(self, name):
+        if name in self._models:
+            return self._models[name]
+
+        with self._lock:
+            if name not in self._models:
+                start = time.perf_counter()
+                self._models[name] = self._loaders[name]()
+                self._load_times[name] = time.perf_counter() - start
+                print(f"[ModelRegistry.get] '{name}' caricato in {self._load_times[name]:.2f}s")
+        return self._models[name]
+
+    def preload(self, names=None):
+        for name in names or list(self._loaders):
+            self.get(name)
+
+    def stats(self):
+        return {
+            "loaded": {name: round(seconds, 3) for name, seconds in self._load_times.items()},
+            "pending": [name for name in self._loaders if name not in self._models],
+        }
+
+
+def timed_import(module_name):
+    """Importa il modulo registrandone il tempo (esclusi i moduli gia' importati da chi lo precede)"""
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    _import_times[module_name] = time.perf_counter() - start
+    return module
+
+
+def report_import_times():
+    """Stampa il tempo di import di ogni modulo passato a timed_import e le librerie pesanti gia' in memoria"""
+    total = sum(_import_times.values())
+    print(f"[report_import_times] Import completati in {total:.2f}s")
+    for module_name, seconds in sorted(_import_times.items(), key=lambda item: item[1], reverse=True):
+        print(f"[report_import_times]   {module_name}: {seconds:.2f}s")
+
+    loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+    print(f"[report_import_times] Librerie pesanti caricate all'avvio: {', '.join(loaded) or 'nessuna'}")
+    return dict(_import_times)
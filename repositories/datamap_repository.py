@@ -2,14 +2,25 @@ from typing import List
 from models.domain import DataMap
 from modules.singleton import singleton
 from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime
+from config.constants import MAP_REGIONS
 import os
 
+
+def _region_rank(region):
+    """Posizione della regione nell'ordine di generazione, le regioni sconosciute vengono prima"""
+    return MAP_REGIONS.index(region) if region in MAP_REGIONS else -1
+
 @singleton
 class DatamapRepository:
     def __init__(self):
         mongo_uri = os.getenv("MONGO_URI", "mongodb://mongo:27017/")
-        self.collection = MongoClient(mongo_uri)["air_quality_db"]["datamaps"]
+        db = MongoClient(mongo_uri)["air_quality_db"]
+        self.collection = db["datamaps"]
+        # Ultima datamap per (region, pollutant) e contatore di generazione per invalidare le cache
+        self.latest_collection = db["datamaps_latest"]
+        self.generation_collection = db["datamaps_generation"]
 
     def find_by_date(self) -> List[DataMap]:
         results = self.collection.find()
@@ -17,6 +28,53 @@ class DatamapRepository:
 
     def save(self, measurement: DataMap):
         self.collection.insert_one(measurement.to_dict())
+        if self._update_latest(measurement):
+            self.generation_collection.update_one(
+                {"_id": "datamaps"}, {"$inc": {"generation": 1}}, upsert=True
+            )
+
+    def _update_latest(self, measurement: DataMap) -> bool:
+        """
+        Sostituisce l'ultima datamap di (region, pollutant) solo se quella salvata non e' piu' recente:
+        un batch vecchio che termina dopo uno nuovo (worker a thread) non la riporta indietro.
+        Il documento ha _id fisso "region:pollutant", la garanzia non dipende dagli indici.
+        Ritorna True se il documento e' cambiato.
+        """
+        latest_id = f"{measurement.region}:{measurement.pollutant}"
+
+        # Documenti con _id generato (versioni precedenti) della stessa coppia
+        self.latest_collection.delete_many(
+            {"region": measurement.region, "pollutant": measurement.pollutant, "_id": {"$ne": latest_id}}
+        )
+
+        try:
+            result = self.latest_collection.replace_one(
+                {"_id": latest_id, "date": {"$lte": measurement.date}},
+                {"_id": latest_id, **measurement.to_dict()},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # Esiste gia' una datamap piu' recente: l'upsert ha provato a inserire un secondo latest_id
+            return False
+        return result.upserted_id is not None or result.modified_count > 0
+
+    def get_generation(self) -> int:
+        doc = self.generation_collection.find_one({"_id": "datamaps"})
+        return doc["generation"] if doc else 0
+
+    def find_latest_materialized(self, pollutant) -> DataMap | None:
+        """
+        Come find_latest_measurement, ma legge dalla tabella delle ultime datamap
+        (un documento per regione); se e' vuota ricade sullo storico.
+        Le mappe di un batch hanno la stessa data: vince l'ultima regione nell'ordine di
+        generazione, la stessa che restava ultima quando le mappe si salvavano in sequenza.
+        """
+        docs = list(self.latest_collection.find({"pollutant": pollutant}))
+        if not docs:
+            return self.find_latest_measurement(pollutant)
+
+        doc = max(docs, key=lambda d: (d["date"], _region_rank(d["region"])))
+        return DataMap.from_dict(doc)
 
     def find_latest_measurement(self, pollutant) -> DataMap | None:
         doc = self.collection.find_one(
@@ -26,6 +84,15 @@ class DatamapRepository:
         return DataMap.from_dict(doc) if doc else None
 
 
+    def find_latest_with_grid(self, pollutant, region="Puglia", before=None) -> DataMap | None:
+        """Datamap piu' recente (al piu' alla data before) con la griglia di predizione salvata"""
+        query = {"pollutant": pollutant, "region": region, "pred_grid_path": {"$ne": None}}
+        if before is not None:
+            query["date"] = {"$lte": datetime.fromisoformat(before) if isinstance(before, str) else before}
+
+        doc = self.collection.find_one(filter=query, sort=[("date", -1)])
+        return DataMap.from_dict(doc) if doc else None
+
     def find_by_exact_date(self, date) -> DataMap:
         dt = datetime.fromisoformat(date) if isinstance(date, str) else date
         doc = self.collection.find_one({"date": dt})
@@ -0,0 +1,83 @@
+from modules.singleton import singleton
+from pymongo import MongoClient, IndexModel, ASCENDING, DESCENDING
+from pymongo.errors import PyMongoError
+from config.constants import INDEX_BOOTSTRAP_TIMEOUT_MS
+import os
+
+INDEXES = {
+    "measurements": [
+        # find_between_dates, find_latest_measurement, find_unique_coords_closest_to_today
+        IndexModel([("misuration_date", ASCENDING)], name="misuration_date_1"),
+        IndexModel([("municipality", ASCENDING), ("misuration_date", ASCENDING)], name="municipality_1_misuration_date_1"),
+    ],
+    "datamaps": [
+        # find_latest_measurement(pollutant): filtro + sort senza scan
+        IndexModel([("pollutant", ASCENDING), ("date", DESCENDING)], name="pollutant_1_date_-1"),
+        IndexModel([("region", ASCENDING), ("pollutant", ASCENDING), ("date", DESCENDING)], name="region_1_pollutant_1_date_-1"),
+    ],
+    "datamaps_latest": [
+        IndexModel([("region", ASCENDING), ("pollutant", ASCENDING)], name="region_1_pollutant_1", unique=True),
+    ],
+}
+
+
+@singleton
+class IndexManager:
+    def __init__(self):
+        mongo_uri = os.getenv("MONGO_URI", "mongodb://mongo:27017/")
+        self.client = MongoClient(mongo_uri, serverSelectionTimeoutMS=INDEX_BOOTSTRAP_TIMEOUT_MS)
+        self.db = self.client["air_quality_db"]
+
+    def ensure_indexes(self):
+        """Crea gli indici dichiarati (idempotente: quelli gia' presenti non vengono ricreati)"""
+        created = {}
+        for collection_name, indexes in INDEXES.items():
+            try:
+                created[collection_name] = self.db[collection_name].create_indexes(indexes)
+            except PyMongoError as e:
+                print(f"[ensure_indexes] Impossibile creare gli indici su '{collection_name}': {e}")
+        return created
+
+    def index_usage(self):
+        """Utilizzo degli indici ($indexStats) e collection scan totali del server"""
+        usage = {}
+        for collection_name in INDEXES:
+            try:
+                stats = self.db[collection_name].aggregate([{"$indexStats": {}}])
+                usage[collection_name] = {
+                    s["name"]: {
+                        "ops": s["accesses"]["ops"],
+                        "since": s["accesses"]["since"].isoformat()
+                    }
+                    for s in stats
+                }
+            except PyMongoError as e:
+                print(f"[index_usage] Statistiche non disponibili per '{collection_name}': {e}")
+
+        collection_scans = None
+        try:
+            status = self.db.command("serverStatus")
+            scans = status.get("metrics", {}).get("queryExecutor", {}).get("collectionScans", {})
+            collection_scans = {"total": scans.get("total"), "non_tailable": scans.get("nonTailable")}
+        except PyMongoError as e:
+            print(f"[index_usage] serverStatus non disponibile: {e}")
+
+        return {"indexes": usage, "collection_scans": collection_scans}
+
+    def bootstrap(self):
+        """Da chiamare all'avvio di app e worker: assicura gli indici e logga lo stato"""
+        try:
+            self.client.admin.command("ping")
+        except PyMongoError as e:
+            # Un solo tentativo breve: senza Mongo l'avvio prosegue, gli indici al prossimo riavvio
+            print(f"[bootstrap] Mongo non raggiungibile, indici non verificati: {e}")
+            return None
+
+        created = self.ensure_indexes()
+        for collection_name, names in created.items():
+            print(f"[bootstrap] Indici su '{collection_name}': {', '.join(names)}")
+
+        report = self.index_usage()
+        if report["collection_scans"] is not None:
+            print(f"[bootstrap] Collection scan dall'avvio del server: {report['collection_scans']['total']}")
+        return report
@@ -1,19 +1,173 @@
-from typing import List
+from typing import List, Iterator, Optional
 from models.domain import AirQualityMeasurement
 from modules.singleton import singleton
+from config.constants import REPORT_GRANULARITIES
 from pymongo import MongoClient, ASCENDING
 from datetime import datetime, timezone, timedelta
+import numpy as np
 import os
 
+DEFAULT_BATCH_SIZE = 1000
+
 @singleton
 class PollutionMeasurementsRepository:
     def __init__(self):
         mongo_uri = os.getenv("MONGO_URI", "mongodb://mongo:27017/")
         self.collection = MongoClient(mongo_uri)["air_quality_db"]["measurements"]
 
-    def find_all_measurements(self) -> List[AirQualityMeasurement]:
-        results = self.collection.find()
-        return [AirQualityMeasurement.from_dict(doc) for doc in results]
+    @staticmethod
+    def pollutant_field(pollutant: str) -> str:
+        """Path del campo valore di un inquinante, da usare nelle projection"""
+        return f"Pollutants.{pollutant}_value"
+
+    @staticmethod
+    def _get_field(doc: dict, path: str):
+        for key in path.split("."):
+            if not isinstance(doc, dict):
+                return None
+            doc = doc.get(key)
+        return doc
+
+    @staticmethod
+    def _to_column(values: list) -> np.ndarray:
+        if values and all(isinstance(v, datetime) for v in values):
+            return np.array([v.replace(tzinfo=None) for v in values], dtype="datetime64[us]")
+        try:
+            return np.array(values, dtype=float)
+        except (TypeError, ValueError):
+            return np.array(values, dtype=object)
+
+    def iter_measurements(self, query: Optional[dict] = None, fields: Optional[List[str]] = None,
+                          sort=None, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator:
+        """
+        Generatore lazy sul cursore Mongo, letto a blocchi di batch_size documenti.
+        Senza fields restituisce AirQualityMeasurement completi; con fields (path tipo
+        "misuration_date" o "Pollutants.pm10_value") solo dict {path: valore} proiettati lato server.
+        """
+        projection = {"_id": 0, **{field: 1 for field in fields}} if fields else None
+        cursor = self.collection.find(query or {}, projection).batch_size(batch_size)
+        if sort:
+            cursor = cursor.sort(sort)
+
+        for doc in cursor:
+            if fields:
+                yield {field: self._get_field(doc, field) for field in fields}
+            else:
+                yield AirQualityMeasurement.from_dict(doc)
+
+    def iter_batches(self, query: Optional[dict] = None, fields: Optional[List[str]] = None,
+                     sort=None, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[list]:
+        """Come iter_measurements, ma a liste di al massimo batch_size elementi"""
+        batch = []
+        for item in self.iter_measurements(query, fields, sort, batch_size):
+            batch.append(item)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def find_columns(self, query: Optional[dict], fields: List[str],
+                     sort=None, batch_size: int = DEFAULT_BATCH_SIZE) -> dict:
+        """
+        Array NumPy per colonna ({path: ndarray}): float (NaN se mancante), datetime64 per le date.
+        I documenti vengono convertiti blocco per blocco, senza materializzare le dataclass.
+        """
+        chunks = {field: [] for field in fields}
+        for batch in self.iter_batches(query, fields, sort, batch_size):
+            for field in fields:
+                chunks[field].append(self._to_column([doc[field] for doc in batch]))
+
+        return {
+            field: np.concatenate(parts) if parts else np.array([], dtype=float)
+            for field, parts in chunks.items()
+        }
+
+    def _find(self, query: dict, fields=None, as_arrays=False, sort=None, batch_size=DEFAULT_BATCH_SIZE):
+        if as_arrays:
+            return self.find_columns(query, fields or ["misuration_date"], sort, batch_size)
+        return list(self.iter_measurements(query, fields, sort, batch_size))
+
+    @staticmethod
+    def _exact_date_query(date) -> dict:
+        return {
+            "misuration_date": datetime.fromisoformat(date).replace(tzinfo=timezone.utc) if isinstance(date, str) else date
+        }
+
+    @staticmethod
+    def _between_dates_query(start_date, end_date) -> dict:
+        start = datetime.fromisoformat(start_date) if isinstance(start_date, str) else start_date
+        end = datetime.fromisoformat(end_date) if isinstance(end_date, str) else end_date
+        return {
+            "misuration_date": {
+                "$gte": start,
+                "$lte": end
+            }
+        }
+
+    def iter_all_measurements(self, fields=None, batch_size=DEFAULT_BATCH_SIZE) -> Iterator:
+        return self.iter_measurements({}, fields, batch_size=batch_size)
+
+    def iter_by_exact_date(self, date, fields=None, batch_size=DEFAULT_BATCH_SIZE) -> Iterator:
+        return self.iter_measurements(self._exact_date_query(date), fields, batch_size=batch_size)
+
+    def iter_between_dates(self, start_date, end_date, fields=None, batch_size=DEFAULT_BATCH_SIZE) -> Iterator:
+        return self.iter_measurements(
+            self._between_dates_query(start_date, end_date), fields,
+            sort=[("misuration_date", ASCENDING)], batch_size=batch_size
+        )
+
+    def aggregate_median_series(self, pollutant: str, start_date, end_date, granularity: Optional[str] = None):
+        """
+        Serie (date, mediane) di un inquinante calcolata interamente in MongoDB.
+        granularity None raggruppa per misuration_date esatta, altrimenti
+        "hour" / "day" / "week" con $dateTrunc (rollup).
+        """
+        if granularity is not None and granularity not in REPORT_GRANULARITIES:
+            raise ValueError(f"Granularita' non supportata: {granularity}")
+
+        field = self.pollutant_field(pollutant)
+        group_key = "$misuration_date"
+        if granularity is not None:
+            group_key = {"$dateTrunc": {"date": "$misuration_date", "unit": granularity}}
+            if granularity == "week":
+                group_key["$dateTrunc"]["startOfWeek"] = "monday"
+
+        # $median richiede MongoDB 7.0: mediana calcolata ordinando i valori del gruppo
+        pipeline = [
+            {"$match": {**self._between_dates_query(start_date, end_date), field: {"$ne": None}}},
+            {"$group": {"_id": group_key, "values": {"$push": f"${field}"}}},
+            {"$project": {
+                "sorted": {"$sortArray": {"input": "$values", "sortBy": 1}},
+                "n": {"$size": "$values"}
+            }},
+            {"$project": {
+                "_id": 1,
+                "value": {"$cond": [
+                    {"$eq": [{"$mod": ["$n", 2]}, 1]},
+                    {"$arrayElemAt": ["$sorted", {"$floor": {"$divide": ["$n", 2]}}]},
+                    {"$avg": [
+                        {"$arrayElemAt": ["$sorted", {"$subtract": [{"$divide": ["$n", 2]}, 1]}]},
+                        {"$arrayElemAt": ["$sorted", {"$divide": ["$n", 2]}]}
+                    ]}
+                ]}
+            }},
+            {"$sort": {"_id": ASCENDING}}
+        ]
+
+        dates = []
+        values = []
+        for doc in self.collection.aggregate(pipeline, allowDiskUse=True):
+            dates.append(doc["_id"])
+            values.append(doc["value"])
+        return dates, values
+
+    def has_measurements_between(self, start_date, end_date) -> bool:
+        """True se nell'intervallo c'e' almeno una misura (indice su misuration_date, nessun documento letto)"""
+        return self.collection.find_one(self._between_dates_query(start_date, end_date), projection={"_id": 1}) is not None
+
+    def find_all_measurements(self, fields=None, as_arrays=False) -> List[AirQualityMeasurement]:
+        return self._find({}, fields, as_arrays)
 
     def save(self, measurement: AirQualityMeasurement):
         self.collection.insert_one(measurement.to_dict())
@@ -29,22 +183,14 @@ class PollutionMeasurementsRepository:
         )
         return AirQualityMeasurement.from_dict(doc) if doc else None
 
-    def find_by_exact_date(self, date: str) -> List[AirQualityMeasurement]:
-        results = self.collection.find({
-            "misuration_date": datetime.fromisoformat(date).replace(tzinfo=timezone.utc) if isinstance(date, str) else date
-        })
-        return [AirQualityMeasurement.from_dict(doc) for doc in results]
+    def find_by_exact_date(self, date: str, fields=None, as_arrays=False) -> List[AirQualityMeasurement]:
+        return self._find(self._exact_date_query(date), fields, as_arrays)
 
-    def find_between_dates(self, start_date: str, end_date: str) -> List[AirQualityMeasurement]:
-        start = datetime.fromisoformat(start_date)
-        end = datetime.fromisoformat(end_date)
-        results = self.collection.find({
-            "misuration_date": {
-                "$gte": start,
-                "$lte": end
-            }
-        }).sort("misuration_date", ASCENDING)
-        return [AirQualityMeasurement.from_dict(doc) for doc in results]
+    def find_between_dates(self, start_date: str, end_date: str, fields=None, as_arrays=False) -> List[AirQualityMeasurement]:
+        return self._find(
+            self._between_dates_query(start_date, end_date), fields, as_arrays,
+            sort=[("misuration_date", ASCENDING)]
+        )
  
     
     def find_unique_coords_closest_to_today(self) -> List[List[float]]:
@@ -0,0 +1,87 @@
+from modules.singleton import singleton
+from pymongo import MongoClient, ReturnDocument
+from datetime import datetime, timezone, timedelta
+import os
+
+JOB_PENDING = "PENDING"
+JOB_RUNNING = "RUNNING"
+JOB_SUCCESS = "SUCCESS"
+JOB_FAILURE = "FAILURE"
+
+
+@singleton
+class SimulationJobRepository:
+    def __init__(self):
+        mongo_uri = os.getenv("MONGO_URI", "mongodb://mongo:27017/")
+        self.collection = MongoClient(mongo_uri)["air_quality_db"]["simulation_jobs"]
+
+    def create_if_absent(self, job_id: str, params: dict, retry_statuses=(JOB_FAILURE,), stale_after=None):
+        """
+        Registra il job se non esiste, o se e' in uno degli stati retry_statuses (per poterlo rilanciare).
+        Con stale_after (secondi) anche un job PENDING/RUNNING non aggiornato da piu' di stale_after
+        viene rilanciato: worker caduto, messaggio perso o pool interrotto.
+        Ritorna (documento, True se va accodato).
+        """
+        now = datetime.now(timezone.utc)
+        pending = {
+            "status": JOB_PENDING,
+            "progress": 0.0,
+            "message": None,
+            "result_path": None,
+            "params": params,
+            "created_at": now,
+            "updated_at": now,
+        }
+
+        result = self.collection.update_one({"_id": job_id}, {"$setOnInsert": pending}, upsert=True)
+        if result.upserted_id is not None:
+            return {"_id": job_id, **pending}, True
+
+        retryable = [{"status": {"$in": list(retry_statuses)}}]
+        if stale_after is not None:
+            retryable.append({
+                "status": {"$in": [JOB_PENDING, JOB_RUNNING]},
+                "updated_at": {"$lt": now - timedelta(seconds=stale_after)}
+            })
+
+        retried = self.collection.find_one_and_update(
+            {"_id": job_id, "$or": retryable},
+            {"$set": pending},
+            return_document=ReturnDocument.AFTER
+        )
+        if retried is not None:
+            return retried, True
+        return self.find_by_id(job_id), False
+
+    def mark_success(self, job_id: str, params: dict, result_path: str) -> dict:
+        """Job completato da un risultato gia' in cache: creato direttamente come SUCCESS"""
+        now = datetime.now(timezone.utc)
+        return self.collection.find_one_and_update(
+            {"_id": job_id},
+            {
+                "$set": {
+                    "status": JOB_SUCCESS,
+                    "progress": 1.0,
+                    "message": None,
+                    "result_path": result_path,
+                    "params": params,
+                    "updated_at": now,
+                },
+                "$setOnInsert": {"created_at": now},
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+
+    def find_by_id(self, job_id: str) -> dict | None:
+        return self.collection.find_one({"_id": job_id})
+
+    def update_status(self, job_id: str, status: str, progress=None, message=None, result_path=None):
+        fields = {"status": status, "updated_at": datetime.now(timezone.utc)}
+        if progress is not None:
+            fields["progress"] = progress
+        if message is not None:
+            fields["message"] = message
+        if result_path is not None:
+            fields["result_path"] = result_path
+        self.collection.update_one({"_id": job_id}, {"$set": fields})
@@ -1,3 +1,7 @@
 #!/bin/bash
 
-python -m tests.model_inference_test
\ No newline at end of file
+python -m tests.model_inference_test
+python -m tests.kriging_operator_cache_test
+python -m tests.local_kriging_test
+python -m tests.trees_utils_test
+python -m tests.simulation_zip_test
\ No newline at end of file
@@ -0,0 +1,331 @@
+import io
+import os
+import math
+import time
+import shutil
+import tempfile
+import zipfile
+from dataclasses import asdict
+from datetime import datetime, timezone
+from celery import Celery
+from repositories.pollution_measurement_repository import PollutionMeasurementsRepository
+from repositories.simulation_job_repository import SimulationJobRepository, JOB_RUNNING, JOB_SUCCESS, JOB_FAILURE
+from utils.filters import filter_by_municipality
+from utils.result_cache import ResultCache, digest_of, make_result_key
+from components.model_inference_service import (
+    extract_measurements_coords_and_values,
+    run_kriging_on_measurements,
+    generate_kriging_map_image
+)
+from components.local_kriging import KRIGING_ENGINES
+from models.domain import Pollutants, AirQualityMeasurement
+from config.constants import (
+    POLLUTANTS,
+    SUPPORTED_SUBREGIONS,
+    TREE_ABSORPTION,
+    TREE_FIELD_SIGMA,
+    CELERY_BROKER_URL,
+    SIMULATION_QUEUE,
+    OUTPUT_SIMULATIONS
+)
+
+SIMULATION_PARAMS = ("lat_min", "lon_min", "lat_max", "lon_max", "n_points", "date")
+SIMULATION_ZIP_NAME = "simulation_results.zip"
+
+# Client usato dalle API Flask solo per accodare i job: il worker li esegue
+celery_client = Celery("myapp", broker=CELERY_BROKER_URL)
+celery_client.conf.task_queues = {
+    SIMULATION_QUEUE: {
+        "exchange": SIMULATION_QUEUE,
+        "routing_key": SIMULATION_QUEUE,
+    }
+}
+
+
+def normalize_simulation_params(data):
+    """
+    Parametri della simulazione in forma canonica (coordinate arrotondate al micro-grado,
+    data ISO), cosi' richieste equivalenti producono lo stesso job. ValueError se non validi.
+    """
+    missing = [name for name in SIMULATION_PARAMS if data.get(name) is None]
+    if missing:
+        raise ValueError(f"Parametri mancanti: {', '.join(missing)}")
+
+    engine = data.get("engine", "auto")
+    if engine not in KRIGING_ENGINES:
+        raise ValueError(f"engine deve essere uno tra {', '.join(KRIGING_ENGINES)}")
+
+    n_points = int(data["n_points"])
+    if n_points <= 0:
+        raise ValueError("n_points deve essere positivo")
+
+    return {
+        "lat_min": round(float(data["lat_min"]), 6),
+        "lon_min": round(float(data["lon_min"]), 6),
+        "lat_max": round(float(data["lat_max"]), 6),
+        "lon_max": round(float(data["lon_max"]), 6),
+        "n_points": n_points,
+        "date": datetime.fromisoformat(str(data["date"])).isoformat(),
+        "engine": engine,
+    }
+
+
+def simulation_job_id(params):
+    """
+    Id del job = chiave della cache dei risultati: parametri normalizzati, misure di Lecce
+    della data e costanti del modello degli alberi. Se le misure cambiano, cambia anche il job.
+    """
+    measurements = filter_by_municipality(
+        PollutionMeasurementsRepository().find_by_exact_date(params["date"]) or [], "Lecce"
+    )
+    # Ordinate per hash della riga: righe con le stesse coordinate non confrontano i dict dei valori
+    inputs = sorted(
+        ([m.longitude, m.latitude, asdict(m.pollutants) if m.pollutants else None] for m in measurements),
+        key=digest_of
+    )
+    model = {"tree_absorption": TREE_ABSORPTION, "tree_field_sigma": TREE_FIELD_SIGMA}
+    return make_result_key("simulation", params, digest_of(inputs), model)
+
+
+def enqueue_simulation(job_id, params):
+    celery_client.send_task("run_simulation", args=[job_id, params], queue=SIMULATION_QUEUE)
+
+
+def get_grid_from_coords(lat_min, lat_max, lon_min, lon_max, n_points):
+    
+    width = lon_max - lon_min
+    height = lat_max - lat_min
+    aspect_ratio = width / height if height != 0 else 1
+    
+    
+    n_cols = round(math.sqrt(n_points * aspect_ratio))
+    n_rows = round(n_points / n_cols) if n_cols != 0 else n_points
+    
+    if n_cols == 0: n_cols = 1
+    if n_rows == 0: n_rows = 1
+
+    return n_rows, n_cols, height, width
+
+
+def build_simulation_points(params):
+    n_rows, n_cols, height, width = get_grid_from_coords(
+        lat_max=params["lat_max"],
+        lat_min=params["lat_min"],
+        lon_max=params["lon_max"],
+        lon_min=params["lon_min"],
+        n_points=params["n_points"]
+    )
+
+    points = []
+    for i in range(n_rows):
+        for j in range(n_cols):
+            lat = params["lat_min"] + (i + 0.5) * (height / n_rows)
+            lon = params["lon_min"] + (j + 0.5) * (width / n_cols)
+            points.append({"lat": lat, "lon": lon})
+    return points
+
+
+class _ZipStreamBuffer(io.RawIOBase):
+    """Destinazione non seekable per ZipFile: accumula i byte scritti finche' non vengono letti con drain()"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _zip_info(arcname):
+    info = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+    info.compress_type = zipfile.ZIP_STORED
+    info.external_attr = 0o644 << 16
+    return info
+
+
+def iter_zip_chunks(entries):
+    """
+    Zip in streaming di (nome, bytes): ogni voce viene emessa appena prodotta, senza compressione
+    (i PNG sono gia' compressi) e senza file temporanei.
+    """
+    buffer = _ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as zipf:
+        for arcname, data in entries:
+            zipf.writestr(_zip_info(arcname), data)
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+def write_zip(entries, zip_path):
+    """Scrive lo zip (non compresso) delle voci (nome, bytes) in zip_path, in modo atomico"""
+    tmp_path = f"{zip_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        for chunk in iter_zip_chunks(entries):
+            f.write(chunk)
+    os.replace(tmp_path, zip_path)
+    return zip_path
+
+
+def iter_prediction_images(measurements, points, engine="auto", progress=None):
+    """Per ogni inquinante esegue il kriging con gli alberi simulati e produce (nome, PNG in memoria)"""
+    simulation_datas = []
+
+    for point in points:
+        lat = point["lat"]
+        lon = point["lon"]
+        sim_measurement = AirQualityMeasurement(
+            misuration_date=datetime.now(timezone.utc),
+            denomination="Simulated Tree Absorption",
+            municipality=None,
+            province=None,
+            latitude=lat,
+            longitude=lon,
+            quality_index=None,         
+            quality_class=None,         
+            area_type=None,              
+            pollutants=Pollutants(
+                c6h6_value=TREE_ABSORPTION["c6h6_value"],
+                co_value=TREE_ABSORPTION["co_value"],
+                h2s_value=TREE_ABSORPTION["h2s_value"],
+                ipa_value=TREE_ABSORPTION["ipa_value"],
+                no2_value=TREE_ABSORPTION["no2_value"],
+                o3_value=TREE_ABSORPTION["o3_value"],
+                pm10_value=TREE_ABSORPTION["pm10_value"],
+                pm2dot5_value=TREE_ABSORPTION["pm2dot5_value"],
+                so2_value=TREE_ABSORPTION["so2_value"],
+            )
+        )
+        simulation_datas.append(sim_measurement)
+
+    for done, pollutant in enumerate(POLLUTANTS, start=1):
+        pollutant = pollutant.lower()
+        if pollutant == "pm2.5":
+            pollutant = "pm2dot5"
+
+        subregion = SUPPORTED_SUBREGIONS[1]
+        bounds = subregion.get("bounds") 
+
+        coords, values = extract_measurements_coords_and_values(measurements, pollutant)
+        sim_coords, sim_values = extract_measurements_coords_and_values(simulation_datas, pollutant)
+
+        lon_grid, lat_grid, pred_grid, std_grid, _ = run_kriging_on_measurements(
+            coords=coords,
+            values=values,
+            bounds=bounds,
+            resolution=100,
+            scale=0.15,
+            lower_scale_bound=0.01,
+            upper_scale_bound=0.02,
+            noise=0.06,
+            simulation_datas=(sim_coords, sim_values),
+            pollutant=pollutant,
+            engine=engine,
+            save_tree_map=False
+        )
+
+        image = io.BytesIO()
+        generate_kriging_map_image(
+            lon_grid, lat_grid, pred_grid, coords, values, pollutant, bounds,
+            "Simulation", True, sim_coords=sim_coords, output=image
+        )
+
+        yield f"kriging_map_{pollutant}.png", image.getvalue()
+
+        if progress is not None:
+            progress(done, len(POLLUTANTS))
+
+
+def run_predictions(measurements, points, zip_output=True, engine="auto", out_dir=None, progress=None):
+    """
+    Con zip_output scrive lo zip delle mappe in out_dir (una cartella per job, nessun file condiviso)
+    e ne ritorna il path; altrimenti ritorna la lista di (nome, PNG).
+    """
+    images = iter_prediction_images(measurements, points, engine=engine, progress=progress)
+    if not zip_output:
+        return list(images)
+
+    out_dir = out_dir or OUTPUT_SIMULATIONS
+    os.makedirs(out_dir, exist_ok=True)
+    return write_zip(images, os.path.join(out_dir, SIMULATION_ZIP_NAME))
+
+
+def load_simulation_measurements(params):
+    """Misure della data, solo Lecce; LookupError se per la data non ci sono misure"""
+    measurements = PollutionMeasurementsRepository().find_by_exact_date(params["date"])
+    if not measurements:
+        raise LookupError(f"Nessuna misura trovata per la data {params['date']}")
+
+    return filter_by_municipality(measurements, "Lecce")
+
+
+def run_simulation(params, out_dir=None, progress=None):
+    """Misure della data (solo Lecce), alberi simulati sulla griglia richiesta, zip delle mappe"""
+    return run_predictions(
+        load_simulation_measurements(params), build_simulation_points(params),
+        engine=params.get("engine", "auto"), out_dir=out_dir, progress=progress
+    )
+
+
+def _tee_to_cache(chunks, job_id):
+    """Inoltra i chunk e ne scrive una copia privata; a zip completo la copia viene spostata nella cache dei risultati"""
+    os.makedirs(OUTPUT_SIMULATIONS, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix="stream-", dir=OUTPUT_SIMULATIONS)
+    zip_path = os.path.join(work_dir, SIMULATION_ZIP_NAME)
+
+    try:
+        with open(zip_path, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+        ResultCache().put(job_id, {SIMULATION_ZIP_NAME: zip_path}, move=True)
+    finally:
+        # anche se il client chiude la connessione a meta'
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def stream_simulation(params, job_id=None):
+    """
+    Simulazione sincrona in streaming: le misure vengono lette subito (gli errori arrivano prima
+    della risposta), poi ogni mappa entra nello zip appena renderizzata.
+    Con job_id lo zip completo viene salvato anche nella cache dei risultati.
+    """
+    measurements = load_simulation_measurements(params)
+    images = iter_prediction_images(measurements, build_simulation_points(params), engine=params.get("engine", "auto"))
+
+    chunks = iter_zip_chunks(images)
+    if job_id is None:
+        return chunks
+    return _tee_to_cache(chunks, job_id)
+
+
+def simulation_job(job_id, params):
+    """Job eseguito nel pool del worker: aggiorna stato e avanzamento su Mongo"""
+    jobs = SimulationJobRepository()
+    jobs.update_status(job_id, JOB_RUNNING, progress=0.0)
+
+    try:
+        zip_path = run_simulation(
+            params,
+            out_dir=os.path.join(OUTPUT_SIMULATIONS, job_id),
+            progress=lambda done, total: jobs.update_status(job_id, JOB_RUNNING, progress=done / total)
+        )
+    except Exception as e:
+        jobs.update_status(job_id, JOB_FAILURE, message=str(e))
+        raise
+
+    # Lo zip viene spostato (non copiato) nella cache, la cartella di lavoro del job non serve piu'
+    entry = ResultCache().put(job_id, {SIMULATION_ZIP_NAME: zip_path}, move=True)
+    shutil.rmtree(os.path.join(OUTPUT_SIMULATIONS, job_id), ignore_errors=True)
+
+    result_path = os.path.abspath(os.path.join(entry, SIMULATION_ZIP_NAME))
+    jobs.update_status(job_id, JOB_SUCCESS, progress=1.0, result_path=result_path)
+    return result_path
@@ -0,0 +1,145 @@
+import tempfile
+import numpy as np
+from sklearn.gaussian_process import GaussianProcessRegressor
+from sklearn.gaussian_process.kernels import RBF, WhiteKernel
+from components.model_inference_service import create_grid
+from components.kriging_operator_cache import predict_on_grid, coords_hash, PredictionOperatorCache
+from models.domain import AirQualityMeasurement, Pollutants
+import components.celery_worker as celery_worker
+import components.kriging_state_store as kriging_state_store
+import components.model_inference_service as model_inference_service
+
+BOUNDS = {"north": 40.4, "south": 40.3, "east": 18.2, "west": 18.1}
+
+
+def fit_gp(coords, values, kernel=None, optimizer="fmin_l_bfgs_b"):
+    kernel = kernel or RBF(length_scale=0.15, length_scale_bounds=(0.01, 0.02)) + WhiteKernel(noise_level=0.06)
+    gp = GaussianProcessRegressor(kernel=kernel, alpha=1e-6, normalize_y=True, optimizer=optimizer)
+    return gp.fit(coords, values)
+
+
+def test_cached_operator_matches_gp_predict():
+    rng = np.random.default_rng(0)
+    coords = rng.random((25, 2)) * 0.1 + [18.1, 40.3]
+    values = rng.random(25) * 40
+    _, _, grid_coords = create_grid(BOUNDS, resolution=20)
+
+    cache = PredictionOperatorCache()
+    cache.clear()
+
+    gp = fit_gp(coords, values)
+    expected_mean, expected_std = gp.predict(grid_coords, return_std=True)
+
+    # Primo calcolo (operatore costruito) e secondo (operatore in cache): stessi risultati di gp.predict
+    for _ in range(2):
+        mean, std = predict_on_grid(gp, grid_coords, BOUNDS, 20)
+        assert np.allclose(mean, expected_mean, rtol=0, atol=1e-8)
+        assert np.allclose(std, expected_std, rtol=0, atol=1e-8)
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+    # Nuovi valori alle stesse stazioni: l'operatore in cache equivale a rifare il GP
+    new_values = rng.random(25) * 40
+    refit = fit_gp(coords, new_values, kernel=gp.kernel_, optimizer=None)
+    operator = cache.get(cache.make_key(BOUNDS, 20, coords, gp.kernel_))
+    mean, std = operator.predict(new_values)
+    expected_mean, expected_std = refit.predict(grid_coords, return_std=True)
+    assert np.allclose(mean, expected_mean, rtol=0, atol=1e-8)
+    assert np.allclose(std, expected_std, rtol=0, atol=1e-8)
+
+
+def make_measurements(rng, stations):
+    return [
+        AirQualityMeasurement(
+            misuration_date="2025-06-19",
+            denomination=f"Stazione {i}",
+            municipality=municipality,
+            province="LE" if municipality == "Lecce" else "BA",
+            latitude=lat,
+            longitude=lon,
+            quality_index=3,
+            quality_class="buona",
+            area_type="urbana",
+            pollutants=Pollutants(**{
+                f"{pollutant}_value": rng.uniform(5, 60)
+                for pollutant in ("pm10", "no2", "c6h6", "co", "h2s", "ipa", "o3", "pm2dot5", "so2")
+            })
+        )
+        for i, (municipality, lon, lat) in enumerate(stations)
+    ]
+
+
+def run_generate_maps(measurements):
+    """generate_maps con i job eseguiti in questo processo, senza rendering ne' mappa health"""
+    original = celery_worker.run_jobs, celery_worker.render_job, celery_worker.health_map_job
+    celery_worker.run_jobs = lambda jobs, **kwargs: {label: fn(*args) for label, fn, args in jobs}
+    celery_worker.render_job = lambda pollutant, *args: pollutant
+    celery_worker.health_map_job = lambda measurements, date: None
+    try:
+        return celery_worker.generate_maps(measurements)
+    finally:
+        celery_worker.run_jobs, celery_worker.render_job, celery_worker.health_map_job = original
+
+
+def test_second_generate_maps_batch_hits_cache():
+    rng = np.random.default_rng(1)
+    stations = [("Bari", 16.0 + rng.random() * 2.5, 40.3 + rng.random() * 1.5) for _ in range(20)]
+    stations += [("Lecce", 18.08 + rng.random() * 0.17, 40.32 + rng.random() * 0.08) for _ in range(8)]
+
+    builds = []
+    build_prediction_operator = model_inference_service.build_prediction_operator
+    model_inference_service.build_prediction_operator = lambda *args, **kwargs: builds.append(1) or build_prediction_operator(*args, **kwargs)
+    state_dir = kriging_state_store.OUTPUT_KRIGING_STATE
+    kriging_state_store.OUTPUT_KRIGING_STATE = tempfile.mkdtemp()
+    cache = PredictionOperatorCache()
+    cache.clear()
+
+    try:
+        # Primo batch: fit, un operatore per regione (Puglia, Lecce-Scaled, Lecce) salvato accanto allo stato
+        run_generate_maps(make_measurements(rng, stations))
+        assert len(builds) == 3
+
+        # Secondo batch, nuovi valori alle stesse stazioni, in un processo nuovo del pool
+        # (cache in memoria vuota): gli operatori arrivano dal disco, nessuno viene ricostruito
+        cache.clear()
+        run_generate_maps(make_measurements(rng, stations))
+        assert len(builds) == 3
+
+        # Terzo batch nello stesso processo: hit in memoria
+        run_generate_maps(make_measurements(rng, stations))
+        assert len(builds) == 3
+        assert cache.stats()["hits"] == 3
+    finally:
+        model_inference_service.build_prediction_operator = build_prediction_operator
+        kriging_state_store.OUTPUT_KRIGING_STATE = state_dir
+
+
+def test_state_of_other_stations_is_refitted():
+    rng = np.random.default_rng(2)
+    coords = rng.random((15, 2)) * 0.1 + [18.1, 40.3]
+    moved = coords.copy()
+    moved[0] += 0.01
+    pollutants = ["pm10"]
+
+    state_dir = kriging_state_store.OUTPUT_KRIGING_STATE
+    kriging_state_store.OUTPUT_KRIGING_STATE = tempfile.mkdtemp()
+    kernel_config = (0.6, 0.1, 0.4, 0.2)
+
+    try:
+        model_inference_service.run_multi_output_kriging(coords, rng.random((15, 1)) * 40, pollutants, bounds=BOUNDS, state_key="test")
+        state = kriging_state_store.load_kriging_state("test", pollutants, kernel_config)
+        assert state["coords_hash"] == coords_hash(coords)
+
+        # Stato recente ma di un altro insieme di stazioni: non viene riusato, il GP viene riaddestrato
+        assert not kriging_state_store.is_state_fresh(state, coords_hash(moved))
+        model_inference_service.run_multi_output_kriging(moved, rng.random((15, 1)) * 40, pollutants, bounds=BOUNDS, state_key="test")
+        state = kriging_state_store.load_kriging_state("test", pollutants, kernel_config)
+        assert state["coords_hash"] == coords_hash(moved)
+    finally:
+        kriging_state_store.OUTPUT_KRIGING_STATE = state_dir
+
+
+if __name__ == "__main__":
+    test_cached_operator_matches_gp_predict()
+    test_second_generate_maps_batch_hits_cache()
+    test_state_of_other_stations_is_refitted()
+    print("kriging_operator_cache_test: OK")
@@ -0,0 +1,55 @@
+import numpy as np
+from sklearn.gaussian_process import GaussianProcessRegressor
+from sklearn.gaussian_process.kernels import RBF, WhiteKernel
+from components.local_kriging import local_kriging_predict, resolve_engine
+
+
+def fit_exact(coords, values):
+    kernel = RBF(length_scale=0.05, length_scale_bounds="fixed") + WhiteKernel(noise_level=0.01, noise_level_bounds="fixed")
+    return GaussianProcessRegressor(kernel=kernel, alpha=1e-6, normalize_y=True).fit(coords, values)
+
+
+def test_local_kriging_matches_exact_with_all_neighbours():
+    rng = np.random.default_rng(1)
+    coords = rng.random((40, 2)) * 0.2
+    values = np.sin(coords[:, 0] * 30) + np.cos(coords[:, 1] * 20)
+    grid = rng.random((200, 2)) * 0.2
+
+    gp = fit_exact(coords, values)
+    expected_mean, expected_std = gp.predict(grid, return_std=True)
+
+    # Con tutti i punti come vicini il kriging locale coincide con il GP esatto
+    mean, std = local_kriging_predict(gp.kernel_, coords, values, grid, n_neighbours=len(coords), block_size=64)
+    assert np.allclose(mean, expected_mean, atol=1e-8)
+    assert np.allclose(std, expected_std, atol=1e-8)
+
+    # Multi-output: una colonna per inquinante, stesse predizioni colonna per colonna
+    mean_2d, _ = local_kriging_predict(gp.kernel_, coords, np.column_stack([values, values]), grid, n_neighbours=len(coords))
+    assert mean_2d.shape == (len(grid), 2)
+    assert np.allclose(mean_2d[:, 1], expected_mean, atol=1e-8)
+
+
+def test_local_kriging_close_to_exact_with_few_neighbours():
+    rng = np.random.default_rng(2)
+    coords = rng.random((300, 2)) * 0.2
+    values = np.sin(coords[:, 0] * 30) + np.cos(coords[:, 1] * 20)
+    grid = rng.random((200, 2)) * 0.16 + 0.02
+
+    gp = fit_exact(coords, values)
+    expected_mean, _ = gp.predict(grid, return_std=True)
+    mean, _ = local_kriging_predict(gp.kernel_, coords, values, grid, n_neighbours=32)
+
+    assert np.abs(mean - expected_mean).max() < 0.01 * np.ptp(values)
+
+
+def test_resolve_engine():
+    assert resolve_engine("auto", 10, threshold=500) == "exact"
+    assert resolve_engine("auto", 1000, threshold=500) == "local"
+    assert resolve_engine("exact", 1000) == "exact"
+
+
+if __name__ == "__main__":
+    test_local_kriging_matches_exact_with_all_neighbours()
+    test_local_kriging_close_to_exact_with_few_neighbours()
+    test_resolve_engine()
+    print("local_kriging_test: OK")
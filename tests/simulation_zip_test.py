@@ -0,0 +1,64 @@
+import io
+import os
+import zipfile
+import tempfile
+from services.simulation_service import iter_zip_chunks, write_zip
+from utils.result_cache import ResultCache
+
+ENTRIES = [
+    ("kriging_map_no2.png", b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 40),
+    ("kriging_map_o3.png", b""),
+    ("kriging_map_pm10.png", os.urandom(5000)),
+]
+
+
+def test_streamed_zip_opens_with_zipfile():
+    chunks = list(iter_zip_chunks(iter(ENTRIES)))
+    # Una voce per chunk, piu' la directory centrale in coda
+    assert len(chunks) == len(ENTRIES) + 1
+
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == [name for name, _ in ENTRIES]
+        for name, data in ENTRIES:
+            assert archive.read(name) == data
+            assert archive.getinfo(name).compress_type == zipfile.ZIP_STORED
+
+
+def test_write_zip_matches_stream():
+    with tempfile.TemporaryDirectory() as directory:
+        zip_path = write_zip(iter(ENTRIES), os.path.join(directory, "simulation_results.zip"))
+        assert os.listdir(directory) == ["simulation_results.zip"]
+        with zipfile.ZipFile(zip_path) as archive:
+            assert {name: archive.read(name) for name in archive.namelist()} == dict(ENTRIES)
+
+
+def test_empty_zip_is_valid():
+    with zipfile.ZipFile(io.BytesIO(b"".join(iter_zip_chunks(iter([]))))) as archive:
+        assert archive.namelist() == []
+
+
+def test_zip_is_moved_into_result_cache():
+    cache = ResultCache()
+    cache_dir = cache.directory
+    with tempfile.TemporaryDirectory() as directory:
+        cache.directory = os.path.join(directory, "cache")
+        try:
+            zip_path = write_zip(iter(ENTRIES), os.path.join(directory, "simulation_results.zip"))
+            inode = os.stat(zip_path).st_ino
+
+            entry = cache.put("job", {"simulation_results.zip": zip_path}, move=True)
+
+            # Stesso file, spostato e non riscritto
+            assert not os.path.exists(zip_path)
+            assert os.stat(os.path.join(entry, "simulation_results.zip")).st_ino == inode
+        finally:
+            cache.directory = cache_dir
+
+
+if __name__ == "__main__":
+    test_streamed_zip_opens_with_zipfile()
+    test_write_zip_matches_stream()
+    test_empty_zip_is_valid()
+    test_zip_is_moved_into_result_cache()
+    print("simulation_zip_test: OK")
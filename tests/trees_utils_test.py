@@ -0,0 +1,54 @@
+import numpy as np
+from components.model_inference_service import create_grid
+from utils.trees_utils import gaussian_sum, tree_absorption_field
+
+BOUNDS = {"north": 40.42, "south": 40.30, "east": 18.22, "west": 18.10}
+SIGMA = 0.008
+
+
+def exact_field(lon_grid, lat_grid, trees, absorption):
+    grid_coords = np.column_stack([lon_grid.ravel(), lat_grid.ravel()])
+    coverage = gaussian_sum(grid_coords, trees, SIGMA).reshape(lon_grid.shape)
+    return absorption * np.minimum(coverage, 1.0)
+
+
+def random_trees(n, seed):
+    rng = np.random.default_rng(seed)
+    return np.column_stack([
+        rng.uniform(BOUNDS["west"], BOUNDS["east"], n),
+        rng.uniform(BOUNDS["south"], BOUNDS["north"], n),
+    ])
+
+
+def test_tree_field_fine_grid_matches_exact_sum():
+    # Passo di griglia < sigma: filtro gaussiano sulla griglia
+    lon_grid, lat_grid, _ = create_grid(BOUNDS, resolution=100)
+    trees = random_trees(60, seed=3)
+
+    field = tree_absorption_field(lon_grid, lat_grid, trees, 2.0, sigma=SIGMA)
+    expected = exact_field(lon_grid, lat_grid, trees, 2.0)
+    assert field.shape == lon_grid.shape
+    assert np.abs(field - expected).max() < 0.01 * 2.0
+
+
+def test_tree_field_coarse_grid_matches_exact_sum():
+    # Passo di griglia > sigma: somma troncata con KD-tree
+    lon_grid, lat_grid, _ = create_grid(BOUNDS, resolution=10)
+    trees = random_trees(60, seed=4)
+
+    field = tree_absorption_field(lon_grid, lat_grid, trees, 2.0, sigma=SIGMA)
+    expected = exact_field(lon_grid, lat_grid, trees, 2.0)
+    # troncamento a 4 sigma: errore < exp(-8) per albero, sommato sugli alberi vicini
+    assert np.abs(field - expected).max() < 5e-3
+
+
+def test_tree_field_without_trees_is_zero():
+    lon_grid, lat_grid, _ = create_grid(BOUNDS, resolution=20)
+    assert not tree_absorption_field(lon_grid, lat_grid, np.empty((0, 2)), 2.0).any()
+
+
+if __name__ == "__main__":
+    test_tree_field_fine_grid_matches_exact_sum()
+    test_tree_field_coarse_grid_matches_exact_sum()
+    test_tree_field_without_trees_is_zero()
+    print("trees_utils_test: OK")
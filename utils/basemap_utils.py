@@ -0,0 +1,109 @@
+import os
+import threading
+import numpy as np
+from config.constants import OUTPUT_BASEMAPS, BASEMAP_ANNOTATED_WIDTH
+from utils.raster_utils import get_raster_size, render_grid_rgba, save_rgba_png
+
+_layers = {}
+_layers_lock = threading.Lock()
+
+
+def _layer_name(bounds, height, width, extra_info):
+    return "basemap_{west}_{east}_{south}_{north}".format(**bounds) + f"_{width}x{height}_{'full' if extra_info else 'coast'}.npy"
+
+
+def rasterize_basemap(bounds, height, width, extra_info=False):
+    """
+    Rasterizza una sola volta i layer statici Natural Earth (costa, e con extra_info
+    confini/terra/mare) in un array RGBA trasparente delle dimensioni richieste.
+    """
+    import cartopy.crs as ccrs
+    import cartopy.feature as cfeature
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    dpi = 100
+    fig = Figure(figsize=(width / dpi, height / dpi), dpi=dpi)
+    canvas = FigureCanvasAgg(fig)
+    fig.patch.set_alpha(0)
+
+    ax = fig.add_axes([0, 0, 1, 1], projection=ccrs.PlateCarree())
+    ax.set_extent([bounds["west"], bounds["east"], bounds["south"], bounds["north"]], crs=ccrs.PlateCarree())
+    ax.patch.set_alpha(0)
+    ax.axis("off")
+
+    if extra_info:
+        ax.add_feature(cfeature.LAND, alpha=0.2, color="lightgray")
+        ax.add_feature(cfeature.OCEAN, alpha=0.2, color="lightblue")
+        ax.add_feature(cfeature.BORDERS, linewidth=0.5)
+
+    ax.add_feature(cfeature.COASTLINE, linewidth=0.5)
+
+    canvas.draw()
+    return np.asarray(canvas.buffer_rgba()).copy()
+
+
+def get_basemap_layer(bounds, height, width, extra_info=False):
+    """
+    Layer RGBA del basemap per (bounds, dimensione output): prima dalla memoria,
+    poi da disco, altrimenti viene rasterizzato e salvato.
+    """
+    name = _layer_name(bounds, height, width, extra_info)
+
+    with _layers_lock:
+        layer = _layers.get(name)
+    if layer is not None:
+        return layer
+
+    path = os.path.join(OUTPUT_BASEMAPS, name)
+    try:
+        layer = np.load(path)
+    except (FileNotFoundError, ValueError, OSError):
+        layer = rasterize_basemap(bounds, height, width, extra_info)
+        os.makedirs(OUTPUT_BASEMAPS, exist_ok=True)
+        # scrittura atomica: piu' processi del pool possono generare lo stesso layer
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, layer)
+        os.replace(tmp_path, path)
+
+    layer.setflags(write=False)
+    with _layers_lock:
+        _layers[name] = layer
+    return layer
+
+
+def alpha_blend(top, bottom):
+    """Composizione 'over' di due immagini RGBA uint8 (alpha non premoltiplicato)"""
+    top_a = top[..., 3:4].astype(np.float32) / 255
+    bottom_a = bottom[..., 3:4].astype(np.float32) / 255
+    out_a = top_a + bottom_a * (1 - top_a)
+
+    out_rgb = top[..., :3] * top_a + bottom[..., :3] * bottom_a * (1 - top_a)
+    out_rgb = np.divide(out_rgb, out_a, out=np.zeros_like(out_rgb), where=out_a > 0)
+
+    return np.concatenate([out_rgb, out_a * 255], axis=-1).round().astype(np.uint8)
+
+
+def render_overlay_png(pred_grid, bounds, output, cmap_name):
+    """Overlay trasparente: raster della predizione con il layer costa in cache sovrapposto"""
+    rgba = render_grid_rgba(pred_grid, bounds, cmap_name)
+    height, width = rgba.shape[:2]
+    rgba = alpha_blend(get_basemap_layer(bounds, height, width, extra_info=False), rgba)
+    return save_rgba_png(rgba, output)
+
+
+def add_basemap_layer(ax, bounds, extra_info=False, zorder=3):
+    """Disegna su un GeoAxes il layer in cache al posto delle feature cartopy"""
+    import cartopy.crs as ccrs
+
+    height, width = get_raster_size(bounds, BASEMAP_ANNOTATED_WIDTH)
+    layer = get_basemap_layer(bounds, height, width, extra_info)
+    ax.imshow(
+        layer,
+        origin="upper",
+        extent=[bounds["west"], bounds["east"], bounds["south"], bounds["north"]],
+        transform=ccrs.PlateCarree(),
+        interpolation="bilinear",
+        zorder=zorder,
+    )
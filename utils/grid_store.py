@@ -0,0 +1,88 @@
+import os
+import json
+import numpy as np
+from functools import lru_cache
+from config.constants import GRID_MMAP_CACHE_SIZE
+from utils.raster_utils import bilinear_sample
+
+
+def get_grid_paths(image_path):
+    """Path di predizione, deviazione standard e metadati salvati accanto all'immagine"""
+    stem = os.path.splitext(image_path)[0]
+    return {
+        "pred": f"{stem}_pred.npy",
+        "std": f"{stem}_std.npy",
+        "meta": f"{stem}_grid.json",
+    }
+
+
+def _atomic_save(path, write):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def save_grids(image_path, pred_grid, std_grid, bounds, resolution):
+    """
+    Salva pred_grid e std_grid come .npy float32 (righe da sud a nord) accanto all'immagine,
+    con bounds e risoluzione in un json. Ritorna i path.
+    """
+    paths = get_grid_paths(image_path)
+    meta = {"bounds": dict(bounds), "resolution": resolution, "shape": list(np.shape(pred_grid))}
+
+    _atomic_save(paths["pred"], lambda f: np.save(f, np.asarray(pred_grid, dtype=np.float32)))
+    _atomic_save(paths["std"], lambda f: np.save(f, np.asarray(std_grid, dtype=np.float32)))
+    _atomic_save(paths["meta"], lambda f: f.write(json.dumps(meta).encode("utf-8")))
+
+    return paths
+
+
+@lru_cache(maxsize=GRID_MMAP_CACHE_SIZE)
+def _open_grid(path, mtime_ns, size):
+    return np.load(path, mmap_mode="r")
+
+
+def load_grid(path):
+    """Griglia memory-mapped, in cache finche' il file non cambia"""
+    st = os.stat(path)
+    return _open_grid(path, st.st_mtime_ns, st.st_size)
+
+
+@lru_cache(maxsize=GRID_MMAP_CACHE_SIZE)
+def _read_meta(path, mtime_ns):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_grid_meta(path):
+    return _read_meta(path, os.stat(path).st_mtime_ns)
+
+
+def sample_grid(grid, bounds, lats, lons):
+    """Valori interpolati bilinearmente nei punti (lat, lon); NaN fuori dai bounds"""
+    ny, nx = grid.shape
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+
+    fx = (lons - bounds["west"]) / (bounds["east"] - bounds["west"]) * (nx - 1)
+    fy = (lats - bounds["south"]) / (bounds["north"] - bounds["south"]) * (ny - 1)
+    return bilinear_sample(grid, fy, fx)
+
+
+def query_grid_values(pred_grid_path, std_grid_path, bounds, lats, lons):
+    """Valore e deviazione standard interpolati per ogni punto; None fuori dalla griglia"""
+    lats = np.atleast_1d(np.asarray(lats, dtype=float))
+    lons = np.atleast_1d(np.asarray(lons, dtype=float))
+    values = sample_grid(load_grid(pred_grid_path), bounds, lats, lons)
+    stds = sample_grid(load_grid(std_grid_path), bounds, lats, lons) if std_grid_path else np.full(values.shape, np.nan)
+
+    return [
+        {
+            "lat": float(lat),
+            "lon": float(lon),
+            "value": float(value) if np.isfinite(value) else None,
+            "std": float(std) if np.isfinite(std) else None,
+        }
+        for lat, lon, value, std in zip(lats, lons, values, stds)
+    ]
@@ -3,9 +3,10 @@ import pandas as pd
 import pickle
 import os
 from datetime import timedelta, date
+from functools import lru_cache
+from modules.singleton import singleton
+from modules.model_registry import ModelRegistry
 os.environ["TF_ENABLE_ONEDNN_OPTS"] = "0"
-import tensorflow as tf
-LoadModel = tf.keras.models.load_model
 
 
 def calculate_and_save_daily_stats(historical_data, filename='daily_stats.pkl'):
@@ -26,30 +27,62 @@ def calculate_and_save_daily_stats(historical_data, filename='daily_stats.pkl'):
     return
 
 
+class WeatherStatsStore:
+    """
+    Statistiche meteo giornaliere caricate una sola volta per processo e indicizzate
+    per (lat, lon, mese, giorno), con la riga globale di fallback gia' calcolata.
+    """
+
+    STATS_COLUMNS = [
+        'temperature_mean', 'temperature_std',
+        'humidity_mean', 'humidity_std',
+        'wind_speed_mean', 'wind_speed_std'
+    ]
+
+    def __init__(self, daily_stats_file):
+        with open(daily_stats_file, 'rb') as f:
+            daily_stats = pickle.load(f)
+
+        rows = daily_stats[self.STATS_COLUMNS].to_numpy(dtype=float)
+        keys = zip(
+            daily_stats['Latitude'].tolist(),
+            daily_stats['Longitude'].tolist(),
+            daily_stats['month'].tolist(),
+            daily_stats['day'].tolist()
+        )
+
+        self.index = {}
+        for key, row in zip(keys, rows):
+            # come stats.iloc[0]: vince la prima riga per chiave
+            self.index.setdefault(key, row)
+
+        self.fallback = daily_stats[self.STATS_COLUMNS].mean().to_numpy(dtype=float)
+
+    def lookup(self, latitude, longitude, month, day):
+        """(temp_mean, temp_std, hum_mean, hum_std, wind_mean, wind_std) per la cella, o il fallback globale"""
+        return self.index.get((latitude, longitude, int(month), int(day)), self.fallback)
+
+
+@lru_cache(maxsize=None)
+def get_weather_stats_store(daily_stats_file='./models/daily_stats.pkl'):
+    return WeatherStatsStore(daily_stats_file)
+
+
 def generate_single_day_forecast(latitude, longitude, target_date, daily_stats_file='./models/daily_stats.pkl', random_seed=42):
     np.random.seed(random_seed)
     
-    with open(daily_stats_file, 'rb') as f:
-        daily_stats = pickle.load(f)
+    store = get_weather_stats_store(daily_stats_file)
     
     if isinstance(target_date, str):
         target_date = pd.to_datetime(target_date)
     
-    stats = daily_stats[
-        (daily_stats['Latitude'] == latitude) &
-        (daily_stats['Longitude'] == longitude) &
-        (daily_stats['month'] == target_date.month) & 
-        (daily_stats['day'] == target_date.day)
-    ]
-    
-    if len(stats) > 0:
-        temp = np.random.normal(stats.iloc[0]['temperature_mean'], stats.iloc[0]['temperature_std'])
-        hum = np.random.normal(stats.iloc[0]['humidity_mean'], stats.iloc[0]['humidity_std'])
-        wind = np.random.normal(stats.iloc[0]['wind_speed_mean'], stats.iloc[0]['wind_speed_std'])
-    else:
-        temp = np.random.normal(daily_stats['temperature_mean'].mean(), daily_stats['temperature_std'].mean())
-        hum = np.random.normal(daily_stats['humidity_mean'].mean(), daily_stats['humidity_std'].mean())
-        wind = np.random.normal(daily_stats['wind_speed_mean'].mean(), daily_stats['wind_speed_std'].mean())
+    temp_mean, temp_std, hum_mean, hum_std, wind_mean, wind_std = store.lookup(
+        latitude, longitude, target_date.month, target_date.day
+    )
+
+    temp = np.random.normal(temp_mean, temp_std)
+    hum = np.random.normal(hum_mean, hum_std)
+    wind = np.random.normal(wind_mean, wind_std)
     
     hum = np.clip(hum, 0, 100)
     wind = max(0, wind)
@@ -78,119 +111,192 @@ def haversine_distance(lon1, lat1, lon2, lat2):
     
     return c * r
 
-def find_nearest_coordinates(longitude, latitude):
+class TrainingCoordinatesIndex:
     """
-    Utilizzo della formula haversine per distanze più accurate
+    Coordinate delle stazioni di training caricate una volta, con ricerca del più vicino
+    tramite haversine vettoriale (query x stazioni) su array NumPy.
     """
-    try:
-        coords_df = pd.read_csv('./models/training_coordinates.csv')
-    except FileNotFoundError:
-        raise FileNotFoundError("File training_coordinates.csv non trovato.")
-    
-    # Calcola distanze usando haversine (più accurato per coordinate geografiche)
-    coords_df['distance_km'] = coords_df.apply(
-        lambda row: haversine_distance(longitude, latitude, row['Longitude'], row['Latitude']), 
-        axis=1
-    )
-    
-    closest = coords_df.loc[coords_df['distance_km'].idxmin()]
-    
-    return {
-        'longitude': closest['Longitude'],
-        'latitude': closest['Latitude'], 
-        'distance_km': closest['distance_km'],
-        'coord_key': f"{closest['Latitude']}_{closest['Longitude']}"
-    }
 
+    EARTH_RADIUS_KM = 6371
 
+    def __init__(self, coordinates_file):
+        try:
+            coords_df = pd.read_csv(coordinates_file)
+        except FileNotFoundError:
+            raise FileNotFoundError("File training_coordinates.csv non trovato.")
 
-def prediction_measuraments(target_date, spatial_target):
+        self.longitudes = coords_df['Longitude'].to_numpy(dtype=float)
+        self.latitudes = coords_df['Latitude'].to_numpy(dtype=float)
+        self._lon_rad = np.radians(self.longitudes)
+        self._lat_rad = np.radians(self.latitudes)
+        self._cos_lat = np.cos(self._lat_rad)
 
-    pollutant_columns = ['PM2.5','PM10','NO2','O3','SO2']
+    def query(self, longitudes, latitudes):
+        """Stazione di training più vicina per ogni punto richiesto"""
+        lon_q = np.radians(np.atleast_1d(np.asarray(longitudes, dtype=float)))[:, np.newaxis]
+        lat_q = np.radians(np.atleast_1d(np.asarray(latitudes, dtype=float)))[:, np.newaxis]
 
-    model = LoadModel("./models/best_model.keras")
+        # Formula haversine
+        dlon = self._lon_rad - lon_q
+        dlat = self._lat_rad - lat_q
+        a = np.sin(dlat/2)**2 + np.cos(lat_q) * self._cos_lat * np.sin(dlon/2)**2
+        distances = 2 * np.arcsin(np.sqrt(a)) * self.EARTH_RADIUS_KM
 
-    with open("./models/last_sequences_updated.pkl", "rb") as f:
-        last_sequences = pickle.load(f)
-    
-    # print(list(last_sequences.keys()))
+        closest = np.argmin(distances, axis=1)
 
-    with open("./models/meteo_scaler.pkl", "rb") as f:
-        meteo_scaler = pickle.load(f)
+        return [
+            {
+                'longitude': self.longitudes[j],
+                'latitude': self.latitudes[j],
+                'distance_km': distances[i, j],
+                'coord_key': f"{self.latitudes[j]}_{self.longitudes[j]}"
+            }
+            for i, j in enumerate(closest)
+        ]
 
-    with open("./models/pollutant_scaler.pkl", "rb") as f:
-        pollutant_scaler = pickle.load(f)
 
-    with open("./models/year_scaler.pkl", "rb") as f:
-        year_scaler = pickle.load(f)
+@lru_cache(maxsize=None)
+def get_training_coordinates_index(coordinates_file='./models/training_coordinates.csv'):
+    return TrainingCoordinatesIndex(coordinates_file)
 
-    with open("./models/coord_scaler.pkl", "rb") as f:
-        coord_scaler = pickle.load(f)
 
+def find_nearest_coordinates_batch(longitudes, latitudes):
+    return get_training_coordinates_index().query(longitudes, latitudes)
 
-    lon, lat = spatial_target
 
-    # Trova le coordinate più vicine presenti nel dataset
-    nearest = find_nearest_coordinates(lon, lat)
-    station_id = nearest['coord_key']
-
-    if station_id not in last_sequences:
-        raise ValueError(f"Nessuna sequenza disponibile per la stazione più vicina {station_id}")
-
-    # Recupera l'ultima sequenza salvata
-    X_seq = last_sequences[station_id]["X_seq"]
+def find_nearest_coordinates(longitude, latitude):
+    """
+    Utilizzo della formula haversine per distanze più accurate
+    """
+    return find_nearest_coordinates_batch([longitude], [latitude])[0]
 
-    # Assicurati che target_date sia un datetime
-    if isinstance(target_date, str):
-        target_date = pd.to_datetime(target_date)
-    current_date = date(2025, 8, 25)
 
-    def get_scaled_meteo(latitudine, longitudine, date):
-        meteo_dict = generate_single_day_forecast(latitudine, longitudine, date)
-        meteo_array = pd.DataFrame(
-            [[meteo_dict['temperature'], meteo_dict['humidity'], meteo_dict['wind_speed']]],
-            columns=['temperature','humidity','wind_speed']
-        )
-        return meteo_scaler.transform(meteo_array)
 
+FORECAST_START_DATE = date(2025, 8, 25)  # primo giorno successivo alle sequenze salvate
+POLLUTANT_COLUMNS = ['PM2.5','PM10','NO2','O3','SO2']
 
-    while current_date <= target_date:
-        # Feature temporali cicliche
-        year_df = pd.DataFrame([[current_date.year]], columns=['year'])
-        year = year_scaler.transform(year_df)[0][0]        
-        month = current_date.month
-        day = current_date.day
-        month_sin = np.sin(2 * np.pi * month / 12)
-        month_cos = np.cos(2 * np.pi * month / 12)
-        day_sin = np.sin(2 * np.pi * day / 31)
-        day_cos = np.cos(2 * np.pi * day / 31)
-        X_temp = np.expand_dims([year, month_sin, month_cos, day_sin, day_cos], axis=0)
 
-        # Feature meteo scalate
-        X_meteo = get_scaled_meteo(nearest['latitude'], nearest['longitude'], current_date)
+@singleton
+class ForecastingEngine:
+    """
+    Modello Keras, scaler e ultime sequenze residenti in memoria: caricati una volta per processo.
+    Il rollout autoregressivo avanza tutte le stazioni richieste insieme, un predict per giorno.
+    """
 
-        # Feature spaziali
+    def __init__(self, models_dir="./models"):
+        # TensorFlow viene importato solo quando serve il modello (vedi ModelRegistry)
+        import tensorflow as tf
+        self.model = tf.keras.models.load_model(os.path.join(models_dir, "best_model.keras"))
+
+        with open(os.path.join(models_dir, "last_sequences_updated.pkl"), "rb") as f:
+            self.last_sequences = pickle.load(f)
+
+        with open(os.path.join(models_dir, "meteo_scaler.pkl"), "rb") as f:
+            self.meteo_scaler = pickle.load(f)
+
+        with open(os.path.join(models_dir, "pollutant_scaler.pkl"), "rb") as f:
+            self.pollutant_scaler = pickle.load(f)
+
+        with open(os.path.join(models_dir, "year_scaler.pkl"), "rb") as f:
+            self.year_scaler = pickle.load(f)
+
+        with open(os.path.join(models_dir, "coord_scaler.pkl"), "rb") as f:
+            self.coord_scaler = pickle.load(f)
+
+    def predict(self, target_date, spatial_targets):
+        """
+        spatial_targets: lista di (lon, lat). Ritorna, nello stesso ordine, il dizionario
+        delle predizioni oppure l'eccezione per le stazioni senza sequenza disponibile.
+        """
+        if isinstance(target_date, str):
+            target_date = pd.to_datetime(target_date)
+        if hasattr(target_date, "date"):
+            target_date = target_date.date()
+
+        if target_date < FORECAST_START_DATE:
+            raise ValueError(f"La data deve essere successiva o uguale a {FORECAST_START_DATE}")
+
+        # Trova le coordinate più vicine presenti nel dataset
+        nearest = find_nearest_coordinates_batch(
+            [lon for lon, _ in spatial_targets],
+            [lat for _, lat in spatial_targets]
+        ) if spatial_targets else []
+
+        # Stazioni distinte con sequenza disponibile: piu' target possono condividere la stessa
+        stations = {}
+        for n in nearest:
+            if n['coord_key'] in self.last_sequences:
+                stations.setdefault(n['coord_key'], n)
+        station_ids = list(stations)
+
+        predictions = {}
+        if station_ids:
+            pred_scaled = self._rollout(target_date, [stations[s] for s in station_ids])
+
+            # Descalare e arrotondare
+            pred_scaled_df = pd.DataFrame(pred_scaled, columns=POLLUTANT_COLUMNS)
+            y_pred_rescaled = self.pollutant_scaler.inverse_transform(pred_scaled_df)
+            rounded_predictions = np.round(y_pred_rescaled).astype(int)
+
+            for row, station_id in enumerate(station_ids):
+                predictions[station_id] = {pollutant: int(rounded_predictions[row, i])
+                                           for i, pollutant in enumerate(POLLUTANT_COLUMNS)}
+
+        return [
+            dict(predictions[n['coord_key']]) if n['coord_key'] in predictions
+            else ValueError(f"Nessuna sequenza disponibile per la stazione più vicina {n['coord_key']}")
+            for n in nearest
+        ]
+
+    def _rollout(self, target_date, stations):
+        # Sequenze iniziali (batch, timesteps, inquinanti)
+        X_seq = np.stack([self.last_sequences[s['coord_key']]["X_seq"] for s in stations])
+
+        # Feature spaziali, costanti durante il rollout
         coords_df = pd.DataFrame(
-            [[nearest['latitude'], nearest['longitude']]],
+            [[s['latitude'], s['longitude']] for s in stations],
             columns=['Latitude', 'Longitude']
         )
-        X_spatial = coord_scaler.transform(coords_df)
+        X_spatial = self.coord_scaler.transform(coords_df)
 
-        # Predizione
-        pred_scaled = model.predict([X_seq[np.newaxis, :, :], X_meteo, X_temp, X_spatial], verbose=0)
+        current_date = FORECAST_START_DATE
+        while current_date <= target_date:
+            # Feature temporali cicliche
+            year_df = pd.DataFrame([[current_date.year]], columns=['year'])
+            year = self.year_scaler.transform(year_df)[0][0]
+            month = current_date.month
+            day = current_date.day
+            month_sin = np.sin(2 * np.pi * month / 12)
+            month_cos = np.cos(2 * np.pi * month / 12)
+            day_sin = np.sin(2 * np.pi * day / 31)
+            day_cos = np.cos(2 * np.pi * day / 31)
+            X_temp = np.tile([year, month_sin, month_cos, day_sin, day_cos], (len(stations), 1))
 
-        # Aggiorna sequenza autoregressiva
-        X_seq = np.vstack([X_seq[1:], pred_scaled])
+            # Feature meteo scalate
+            meteo = [generate_single_day_forecast(s['latitude'], s['longitude'], current_date) for s in stations]
+            meteo_df = pd.DataFrame(
+                [[m['temperature'], m['humidity'], m['wind_speed']] for m in meteo],
+                columns=['temperature','humidity','wind_speed']
+            )
+            X_meteo = self.meteo_scaler.transform(meteo_df)
 
-        current_date += timedelta(days=1)
+            # Predizione di tutte le stazioni in un solo batch
+            pred_scaled = np.asarray(self.model.predict_on_batch([X_seq, X_meteo, X_temp, X_spatial]))
 
-    # Descalare e arrotondare
-    pred_scaled_df = pd.DataFrame(pred_scaled, columns=pollutant_columns)
-    y_pred_rescaled = pollutant_scaler.inverse_transform(pred_scaled_df)
-    rounded_predictions = np.round(y_pred_rescaled).astype(int)
+            # Aggiorna sequenze autoregressive
+            X_seq = np.concatenate([X_seq[:, 1:, :], pred_scaled[:, np.newaxis, :]], axis=1)
 
-    # Creazione dizionario finale
-    prediction_dict = {pollutant: int(rounded_predictions[0, i]) 
-                       for i, pollutant in enumerate(pollutant_columns)}
+            current_date += timedelta(days=1)
 
-    return prediction_dict
\ No newline at end of file
+        return pred_scaled
+
+
+def prediction_measuraments_batch(target_date, spatial_targets):
+    return ModelRegistry().get("forecaster").predict(target_date, spatial_targets)
+
+
+def prediction_measuraments(target_date, spatial_target):
+    prediction = prediction_measuraments_batch(target_date, [spatial_target])[0]
+    if isinstance(prediction, Exception):
+        raise prediction
+    return prediction
@@ -0,0 +1,69 @@
+import time
+import threading
+from flask import Response, current_app
+from models.dto import DataMapDTO, DataMapResponseDTO
+from repositories.datamap_repository import DatamapRepository
+from config.constants import LATEST_DATAMAP_CACHE_TTL
+
+
+class GenerationTTLCache:
+    """
+    Cache in memoria di risposte gia' serializzate.
+    Alla scadenza del TTL si rilegge solo il contatore di generazione: se non e' cambiato
+    (nessuna nuova datamap salvata) la voce viene rinnovata senza ricaricarla.
+    """
+
+    def __init__(self, generation_fn, ttl=LATEST_DATAMAP_CACHE_TTL):
+        self.generation_fn = generation_fn
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key, loader):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and now < entry["expires_at"]:
+            return entry["value"]
+
+        generation = self.generation_fn()
+        if entry is not None and entry["generation"] == generation:
+            value = entry["value"]
+        else:
+            value = loader()
+
+        with self._lock:
+            self._entries[key] = {"value": value, "generation": generation, "expires_at": now + self.ttl}
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_cache = GenerationTTLCache(lambda: DatamapRepository().get_generation())
+
+
+def _build_latest_body(pollutant):
+    latest = DatamapRepository().find_latest_materialized(pollutant=pollutant)
+
+    if not latest:
+        payload, status = {
+            "status": "error",
+            "message": "Nessuna datamap trovata",
+            "data": {}
+        }, 404
+    else:
+        payload, status = DataMapResponseDTO(
+            response=0,
+            message="Datamap recuperata correttamente",
+            payload=[DataMapDTO.from_domain(latest)]
+        ).to_dict(), 200
+
+    return current_app.json.dumps(payload), status
+
+
+def latest_datamap_response(pollutant):
+    """Risposta JSON della datamap piu' recente per l'inquinante, servita dalla cache in memoria"""
+    body, status = _cache.get_or_load(pollutant, lambda: _build_latest_body(pollutant))
+    return Response(body, status=status, mimetype="application/json")
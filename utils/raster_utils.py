@@ -0,0 +1,90 @@
+import numpy as np
+import matplotlib
+from PIL import Image
+from functools import lru_cache
+from config.constants import MAP_LEVELS, FAST_RENDER_WIDTH
+
+
+@lru_cache(maxsize=32)
+def get_colormap_lut(cmap_name, levels=MAP_LEVELS):
+    """
+    LUT RGBA (levels x 4, uint8) con un colore per fascia, come contourf:
+    ogni fascia prende il colore del suo valore centrale.
+    """
+    cmap = matplotlib.colormaps[cmap_name]
+    lut = cmap((np.arange(levels) + 0.5) / levels, bytes=True)
+    lut.setflags(write=False)
+    return lut
+
+
+def bilinear_sample(grid, fy, fx):
+    """
+    Interpolazione bilineare di grid in coordinate frazionarie di indice (fy righe, fx colonne).
+    fy e fx devono essere broadcastabili tra loro; i punti fuori griglia valgono NaN.
+    """
+    ny, nx = grid.shape
+    fy, fx = np.broadcast_arrays(np.asarray(fy, dtype=float), np.asarray(fx, dtype=float))
+    outside = (fy < 0) | (fy > ny - 1) | (fx < 0) | (fx > nx - 1) | ~np.isfinite(fy) | ~np.isfinite(fx)
+
+    fy = np.clip(np.nan_to_num(fy), 0, ny - 1)
+    fx = np.clip(np.nan_to_num(fx), 0, nx - 1)
+    y0 = np.minimum(fy.astype(int), max(ny - 2, 0))
+    x0 = np.minimum(fx.astype(int), max(nx - 2, 0))
+    y1 = np.minimum(y0 + 1, ny - 1)
+    x1 = np.minimum(x0 + 1, nx - 1)
+    wy = fy - y0
+    wx = fx - x0
+
+    top = grid[y0, x0] * (1 - wx) + grid[y0, x1] * wx
+    bottom = grid[y1, x0] * (1 - wx) + grid[y1, x1] * wx
+    values = top * (1 - wy) + bottom * wy
+
+    return np.where(outside, np.nan, values)
+
+
+def grid_to_rgba(values, vmin, vmax, cmap_name, levels=MAP_LEVELS):
+    """Quantizza i valori in `levels` fasce tra vmin e vmax e li mappa sulla LUT; NaN trasparenti"""
+    lut = get_colormap_lut(cmap_name, levels)
+    finite = np.isfinite(values)
+
+    if vmax > vmin:
+        idx = ((np.where(finite, values, vmin) - vmin) / (vmax - vmin) * levels).astype(int)
+        idx = np.clip(idx, 0, levels - 1)
+    else:
+        idx = np.zeros(values.shape, dtype=int)
+
+    rgba = lut[idx]
+    rgba[~finite] = 0
+    return rgba
+
+
+def get_raster_size(bounds, width=FAST_RENDER_WIDTH):
+    """Dimensioni (altezza, larghezza) in pixel con proporzioni PlateCarree"""
+    height = round(width * (bounds["north"] - bounds["south"]) / (bounds["east"] - bounds["west"]))
+    return max(height, 1), width
+
+
+def render_grid_rgba(pred_grid, bounds, cmap_name, levels=MAP_LEVELS, width=FAST_RENDER_WIDTH):
+    """
+    Raster RGBA (nord in alto) della griglia di predizione, ricampionata bilinearmente
+    alla dimensione di output e colorata a fasce come contourf.
+    """
+    pred_grid = np.asarray(pred_grid, dtype=float)
+    height, width = get_raster_size(bounds, width)
+    ny, nx = pred_grid.shape
+
+    fy = np.linspace(ny - 1, 0, height)[:, None]
+    fx = np.linspace(0, nx - 1, width)[None, :]
+    values = bilinear_sample(pred_grid, fy, fx)
+
+    return grid_to_rgba(values, np.nanmin(pred_grid), np.nanmax(pred_grid), cmap_name, levels)
+
+
+def save_rgba_png(rgba, output):
+    """Codifica direttamente l'array RGBA in PNG (path o file-like)"""
+    Image.fromarray(np.ascontiguousarray(rgba, dtype=np.uint8)).save(output, format="PNG")
+    return output
+
+
+def render_grid_to_png(pred_grid, bounds, output, cmap_name, levels=MAP_LEVELS, width=FAST_RENDER_WIDTH):
+    return save_rgba_png(render_grid_rgba(pred_grid, bounds, cmap_name, levels, width), output)
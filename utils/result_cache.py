@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from modules.singleton import singleton
+from config.constants import OUTPUT_RESULT_CACHE, RESULT_CACHE_MAX_BYTES
+
+PAYLOAD_FILE = "payload.json"
+
+
+def digest_of(value):
+    """Hash stabile di un valore serializzabile in JSON (chiavi ordinate, tipi non JSON come stringa)"""
+    encoded = json.dumps(value, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def artifact_versions(paths):
+    """Versione dei file dei modelli (mtime e dimensione): un modello riaddestrato cambia la chiave"""
+    versions = {}
+    for path in paths:
+        try:
+            st = os.stat(path)
+            versions[path] = f"{st.st_mtime_ns}-{st.st_size}"
+        except OSError:
+            versions[path] = None
+    return versions
+
+
+def make_result_key(kind, params, inputs_digest, artifacts=None):
+    """Chiave di cache: tipo di risultato, parametri normalizzati, hash degli input, versioni dei modelli"""
+    return digest_of({"kind": kind, "params": params, "inputs": inputs_digest, "artifacts": artifacts or {}})
+
+
+def load_payload(entry):
+    with open(os.path.join(entry, PAYLOAD_FILE), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+@singleton
+class ResultCache:
+    """
+    Cache su disco dei risultati di simulazione, indirizzata per contenuto: la chiave e' l'hash di
+    parametri normalizzati, dati di input e versioni dei modelli. Ogni voce e' una cartella con i file
+    prodotti (zip, png) e un eventuale payload JSON; oltre max_bytes si eliminano le voci usate meno di recente.
+    """
+
+    def __init__(self, directory=OUTPUT_RESULT_CACHE, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """Cartella della voce, None se assente; l'accesso aggiorna l'ordine LRU (mtime)"""
+        entry = self._entry_dir(key)
+        found = os.path.isdir(entry)
+        with self._lock:
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not found:
+            return None
+
+        try:
+            os.utime(entry)
+        except OSError:
+            return None
+        return entry
+
+    def put(self, key, files, payload=None, move=False):
+        """
+        Copia i file {nome: path} nella voce (scrittura atomica della cartella) e applica il limite
+        di dimensione. Con move i file vengono spostati: un rename se sorgente e cache sono sullo
+        stesso filesystem, senza riscrivere il contenuto. Ritorna la cartella della voce.
+        """
+        entry = self._entry_dir(key)
+        tmp_entry = f"{entry}.{os.getpid()}.{threading.get_ident()}.tmp"
+        os.makedirs(tmp_entry, exist_ok=True)
+
+        for name, path in files.items():
+            if move:
+                shutil.move(path, os.path.join(tmp_entry, name))
+            else:
+                shutil.copyfile(path, os.path.join(tmp_entry, name))
+        if payload is not None:
+            with open(os.path.join(tmp_entry, PAYLOAD_FILE), "w", encoding="utf-8") as f:
+                json.dump(payload, f, default=str)
+
+        try:
+            os.rename(tmp_entry, entry)
+        except OSError:
+            # la stessa voce e' stata scritta nel frattempo da un altro processo: contenuto identico
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+
+        self.evict()
+        return entry
+
+    def _entries(self):
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+
+        for name in os.listdir(self.directory):
+            entry = os.path.join(self.directory, name)
+            if name.endswith(".tmp") or not os.path.isdir(entry):
+                continue
+            try:
+                size = sum(f.stat().st_size for f in os.scandir(entry) if f.is_file())
+                entries.append((os.stat(entry).st_mtime, size, entry))
+            except OSError:
+                continue
+        return entries
+
+    def evict(self):
+        """Elimina le voci meno recenti finche' la cache non rientra in max_bytes"""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+
+        for _, size, entry in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            print(f"[ResultCache.evict] Rimossa voce {os.path.basename(entry)}")
+
+    def stats(self):
+        entries = self._entries()
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(entries),
+                "bytes": sum(size for _, size, _ in entries),
+                "max_bytes": self.max_bytes,
+                "oldest_entry_age_s": time.time() - min(e[0] for e in entries) if entries else None,
+            }
@@ -0,0 +1,82 @@
+import os
+import math
+import numpy as np
+from config.constants import TILE_SIZE, TILE_ZOOM_LEVELS
+from utils.raster_utils import bilinear_sample, grid_to_rgba, save_rgba_png
+
+
+def lon_to_tile_x(lon, zoom):
+    return (lon + 180.0) / 360.0 * (1 << zoom)
+
+
+def lat_to_tile_y(lat, zoom):
+    lat_rad = math.radians(lat)
+    return (1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * (1 << zoom)
+
+
+def get_zoom_range(bounds, levels=TILE_ZOOM_LEVELS):
+    """Zoom da quello in cui la regione sta in circa una tile, per `levels` livelli"""
+    min_zoom = max(int(math.floor(math.log2(360.0 / (bounds["east"] - bounds["west"])))), 0)
+    return range(min_zoom, min_zoom + levels)
+
+
+def get_tile_range(bounds, zoom):
+    """Indici (x, y) delle tile XYZ che coprono i bounds al livello zoom"""
+    last = (1 << zoom) - 1
+    x0 = min(int(lon_to_tile_x(bounds["west"], zoom)), last)
+    x1 = min(int(lon_to_tile_x(bounds["east"], zoom)), last)
+    y0 = min(int(lat_to_tile_y(bounds["north"], zoom)), last)
+    y1 = min(int(lat_to_tile_y(bounds["south"], zoom)), last)
+    return range(x0, x1 + 1), range(y0, y1 + 1)
+
+
+def tile_pixel_coords(zoom, x, y, size=TILE_SIZE):
+    """Longitudini (colonne) e latitudini (righe) dei centri pixel di una tile Web Mercator"""
+    n = size * (1 << zoom)
+    px = (x * size + np.arange(size) + 0.5) / n
+    py = (y * size + np.arange(size) + 0.5) / n
+    lons = px * 360.0 - 180.0
+    lats = np.degrees(np.arctan(np.sinh(np.pi * (1.0 - 2.0 * py))))
+    return lons, lats
+
+
+def render_tile_rgba(pred_grid, bounds, zoom, x, y, vmin, vmax, cmap_name, size=TILE_SIZE):
+    """
+    Tile RGBA (righe da nord a sud, come le immagini XYZ) campionata dalla griglia di predizione,
+    le cui righe vanno invece da sud a nord. None se la tile e' vuota.
+    vmin/vmax sono quelli dell'intera griglia, cosi' i colori restano coerenti tra tile.
+    """
+    ny, nx = pred_grid.shape
+    lons, lats = tile_pixel_coords(zoom, x, y, size)
+
+    fx = (lons - bounds["west"]) / (bounds["east"] - bounds["west"]) * (nx - 1)
+    fy = (lats - bounds["south"]) / (bounds["north"] - bounds["south"]) * (ny - 1)
+    values = bilinear_sample(pred_grid, fy[:, None], fx[None, :])
+
+    if not np.isfinite(values).any():
+        return None
+    return grid_to_rgba(values, vmin, vmax, cmap_name)
+
+
+def write_tile_pyramid(pred_grid, bounds, output_dir, cmap_name, levels=TILE_ZOOM_LEVELS):
+    """
+    Scrive la piramide XYZ (<output_dir>/<z>/<x>/<y>.png) della griglia di predizione,
+    saltando le tile fuori dalla regione. Ritorna il numero di tile scritte.
+    """
+    pred_grid = np.asarray(pred_grid, dtype=float)
+    vmin, vmax = np.nanmin(pred_grid), np.nanmax(pred_grid)
+    written = 0
+
+    for zoom in get_zoom_range(bounds, levels):
+        xs, ys = get_tile_range(bounds, zoom)
+        for x in xs:
+            for y in ys:
+                rgba = render_tile_rgba(pred_grid, bounds, zoom, x, y, vmin, vmax, cmap_name)
+                if rgba is None:
+                    continue
+                tile_dir = os.path.join(output_dir, str(zoom), str(x))
+                os.makedirs(tile_dir, exist_ok=True)
+                save_rgba_png(rgba, os.path.join(tile_dir, f"{y}.png"))
+                written += 1
+
+    return written
@@ -1,4 +1,36 @@
 import numpy as np
+from scipy.spatial import cKDTree
+from scipy.ndimage import gaussian_filter
+from config.constants import TREE_FIELD_SIGMA, TREE_FIELD_TRUNCATE
+
+GAUSSIAN_CHUNK_SIZE = 256
+
+
+def gaussian_sum(grid_coords, centers, sigma, truncate=None):
+    """
+    Somma in ogni punto della griglia delle gaussiane exp(-d^2 / 2 sigma^2) centrate in centers.
+    Con truncate=None il calcolo e' esatto (denso, a blocchi di centri); altrimenti contano solo
+    i centri entro truncate * sigma, trovati con un KD-tree (errore < exp(-truncate^2 / 2) per centro).
+    """
+    grid_coords = np.asarray(grid_coords, dtype=float)
+    centers = np.asarray(centers, dtype=float).reshape(-1, 2)
+    total = np.zeros(len(grid_coords))
+    if len(centers) == 0:
+        return total
+
+    if truncate is None:
+        for start in range(0, len(centers), GAUSSIAN_CHUNK_SIZE):
+            chunk = centers[start:start + GAUSSIAN_CHUNK_SIZE]
+            dist_sq = ((grid_coords[:, None, :] - chunk[None, :, :]) ** 2).sum(axis=-1)
+            total += np.exp(-dist_sq / (2 * sigma**2)).sum(axis=1)
+        return total
+
+    pairs = cKDTree(grid_coords).sparse_distance_matrix(
+        cKDTree(centers), truncate * sigma, output_type="ndarray"
+    )
+    np.add.at(total, pairs["i"], np.exp(-pairs["v"]**2 / (2 * sigma**2)))
+    return total
+
 
 def generate_tree_gaussians(grid_coords, sim_coords, sigma=0.01, peak=5, offset=0):
     """
@@ -6,8 +38,60 @@ def generate_tree_gaussians(grid_coords, sim_coords, sigma=0.01, peak=5, offset=
     - sigma: larghezza della gaussiana (in gradi lat/lon)
     - peak: valore massimo della gaussiana
     """
-    gaussians = np.zeros(len(grid_coords))
-    for tree in sim_coords:
-        dist_sq = (grid_coords[:, 0] - tree[0])**2 + (grid_coords[:, 1] - tree[1])**2
-        gaussians += (peak * np.exp(-dist_sq / (2 * sigma**2)))-offset 
-    return gaussians
+    return peak * gaussian_sum(grid_coords, sim_coords, sigma) - offset * len(sim_coords)
+
+
+def gaussian_sum_on_grid(lon_grid, lat_grid, centers, sigma, truncate):
+    """
+    Come gaussian_sum, su una griglia regolare (meshgrid, righe da sud a nord): i centri vengono
+    distribuiti bilinearmente sulle celle e la somma diventa un filtro gaussiano separabile.
+    Costo O(alberi + celle); accurato quando sigma e' almeno pari al passo della griglia.
+    """
+    centers = np.asarray(centers, dtype=float).reshape(-1, 2)
+    ny, nx = lon_grid.shape
+    dx = (lon_grid[0, -1] - lon_grid[0, 0]) / (nx - 1)
+    dy = (lat_grid[-1, 0] - lat_grid[0, 0]) / (ny - 1)
+    sigma_x, sigma_y = sigma / dx, sigma / dy
+
+    # bordo per gli alberi poco fuori dalla griglia, che contribuiscono comunque
+    pad_x, pad_y = int(np.ceil(truncate * sigma_x)) + 1, int(np.ceil(truncate * sigma_y)) + 1
+    hist = np.zeros((ny + 2 * pad_y, nx + 2 * pad_x))
+
+    fx = (centers[:, 0] - lon_grid[0, 0]) / dx + pad_x
+    fy = (centers[:, 1] - lat_grid[0, 0]) / dy + pad_y
+    x0, y0 = np.floor(fx).astype(int), np.floor(fy).astype(int)
+    wx, wy = fx - x0, fy - y0
+    inside = (x0 >= 0) & (y0 >= 0) & (x0 < hist.shape[1] - 1) & (y0 < hist.shape[0] - 1)
+    x0, y0, wx, wy = x0[inside], y0[inside], wx[inside], wy[inside]
+
+    np.add.at(hist, (y0, x0), (1 - wy) * (1 - wx))
+    np.add.at(hist, (y0, x0 + 1), (1 - wy) * wx)
+    np.add.at(hist, (y0 + 1, x0), wy * (1 - wx))
+    np.add.at(hist, (y0 + 1, x0 + 1), wy * wx)
+
+    # gaussian_filter ha area unitaria, le gaussiane degli alberi hanno picco unitario
+    smoothed = gaussian_filter(hist, sigma=(sigma_y, sigma_x), mode="constant", truncate=truncate)
+    smoothed *= 2 * np.pi * sigma_x * sigma_y
+    return smoothed[pad_y:pad_y + ny, pad_x:pad_x + nx]
+
+
+def tree_absorption_field(lon_grid, lat_grid, sim_coords, absorption, sigma=TREE_FIELD_SIGMA, truncate=TREE_FIELD_TRUNCATE):
+    """
+    Campo di assorbimento degli alberi sulla griglia, in forma chiusa al posto del fit di un GP:
+    absorption * min(copertura, 1), con copertura = somma delle gaussiane degli alberi.
+    Griglie fini: filtro gaussiano separabile; griglie piu' rade di sigma: somma troncata con KD-tree.
+    """
+    ny, nx = lon_grid.shape
+    fine_grid = (
+        nx > 1 and ny > 1
+        and (lon_grid[0, -1] - lon_grid[0, 0]) / (nx - 1) <= sigma
+        and (lat_grid[-1, 0] - lat_grid[0, 0]) / (ny - 1) <= sigma
+    )
+
+    if fine_grid:
+        coverage = gaussian_sum_on_grid(lon_grid, lat_grid, sim_coords, sigma, truncate)
+    else:
+        grid_coords = np.column_stack([lon_grid.ravel(), lat_grid.ravel()])
+        coverage = gaussian_sum(grid_coords, sim_coords, sigma, truncate).reshape(lon_grid.shape)
+
+    return absorption * np.minimum(coverage, 1.0)